@@ -0,0 +1,216 @@
+import datetime
+import os
+import subprocess
+
+# Everything is committed by the same person at made up (but fixed) times so
+# the generated shas are the same every time for the same parameters.
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "Bench",
+    "GIT_AUTHOR_EMAIL": "bench@example.com",
+    "GIT_COMMITTER_NAME": "Bench",
+    "GIT_COMMITTER_EMAIL": "bench@example.com",
+    # The submodules are cloned from local paths.
+    "GIT_CONFIG_COUNT": "1",
+    "GIT_CONFIG_KEY_0": "protocol.file.allow",
+    "GIT_CONFIG_VALUE_0": "always",
+}
+EPOCH = 1_600_000_000
+
+LOCALES = (
+    "af ar az bg bn ca cs de el es fa fi fr he hi-IN hu id it ja ka ko ms my nl "
+    "pl pt-BR pt-PT ro ru sq sv-SE te th tl tr uk vi zh-CN zh-TW"
+).split()
+
+
+def git(*args, cwd=None):
+    return subprocess.run(
+        ["git", *args],
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=dict(os.environ, **GIT_ENV),
+    ).stdout.decode("utf-8")
+
+
+def fast_import(git_dir, commits):
+    """Create the bare repo `git_dir` with a master branch of `commits`, a
+    sequence of (message, files). `files` is a dict of path -> bytes, or
+    path -> str for a gitlink (a submodule) to that sha."""
+    git("init", "-q", "--bare", "--initial-branch=master", git_dir)
+    process = subprocess.Popen(
+        ["git", "fast-import", "--quiet"],
+        cwd=git_dir,
+        stdin=subprocess.PIPE,
+        env=dict(os.environ, **GIT_ENV),
+    )
+    for i, (message, files) in enumerate(commits):
+        message = message.encode("utf-8")
+        chunks = [
+            b"commit refs/heads/master\n",
+            f"committer Bench <bench@example.com> {EPOCH + i * 60} +0000\n".encode(),
+            f"data {len(message)}\n".encode(),
+            message,
+            b"\n",
+        ]
+        for path, content in files.items():
+            if isinstance(content, str):
+                chunks.append(f"M 160000 {content} {path}\n".encode())
+            else:
+                chunks.append(f"M 100644 inline {path}\n".encode())
+                chunks.append(f"data {len(content)}\n".encode())
+                chunks.append(content)
+                chunks.append(b"\n")
+        process.stdin.write(b"".join(chunks))
+    process.stdin.close()
+    if process.wait():
+        raise RuntimeError(f"git fast-import failed for {git_dir}")
+
+
+def make_catalog(locale, strings, translated=0.7):
+    """Return a PO file with `strings` entries, about `translated` of them
+    translated. Some are fuzzy, some are plurals and some are multi-line."""
+    lines = [
+        'msgid ""',
+        'msgstr ""',
+        f'"Language: {locale}\\n"',
+        '"Content-Type: text/plain; charset=UTF-8\\n"',
+        "",
+    ]
+    for i in range(strings):
+        done = (i * 7919 + len(locale)) % 100 < translated * 100
+        lines.append(f"#: kuma/app{i % 200}.py:{i}")
+        if done and i % 23 == 0:
+            lines.append("#, fuzzy")
+        if i % 11 == 0:
+            lines.append(f'msgid "One thing number {i}"')
+            lines.append(f'msgid_plural "%(count)s things number {i}"')
+            lines.append(f'msgstr[0] "{f"{locale} {i}" if done else ""}"')
+            lines.append(f'msgstr[1] "{f"{locale} {i}s" if done else ""}"')
+        elif i % 7 == 0:
+            lines.append('msgid ""')
+            lines.append(f'"A longer string, number {i}, that is "')
+            lines.append('"wrapped over more than one line."')
+            lines.append(f'msgstr "{f"{locale} {i}" if done else ""}"')
+        else:
+            lines.append(f'msgid "String number {i}"')
+            lines.append(f'msgstr "{f"{locale} {i}" if done else ""}"')
+        lines.append("")
+    return "\n".join(lines).encode("utf-8")
+
+
+def make_fixture(root, commits=2000, locales=30, strings=2000, behind=20):
+    """Generate, in `root`, the bare "upstream" repos 'up/kuma.git',
+    'up/kumascript.git' and 'up/locale.git', an empty 'up/fork.git' (for
+    the pull request branches) and a clone of Kuma, with its submodules,
+    in 'kuma'. Every repo has `commits` commits of history and the
+    submodules are pinned `behind` commits behind their upstream master.
+    Returns a dict of those paths."""
+    up = os.path.join(root, "up")
+    paths = {
+        "kuma_upstream": os.path.join(up, "kuma.git"),
+        "kumascript_upstream": os.path.join(up, "kumascript.git"),
+        "locale_upstream": os.path.join(up, "locale.git"),
+        "fork": os.path.join(up, "fork.git"),
+        "kuma": os.path.join(root, "kuma"),
+    }
+    os.makedirs(up)
+
+    fast_import(
+        paths["kumascript_upstream"],
+        [
+            (
+                f"Merge pull request #{i} from someone/branch-{i}",
+                {f"macros/Macro{i % 50}.ejs": f"<%# {i} %>\n".encode()},
+            )
+            for i in range(commits)
+        ],
+    )
+
+    chosen = LOCALES[:locales]
+    catalogs = {
+        f"{locale}/LC_MESSAGES/django.po": make_catalog(locale, strings)
+        for locale in chosen
+    }
+    fast_import(
+        paths["locale_upstream"],
+        [("Initial catalogs", catalogs)]
+        + [
+            (
+                f"Pontoon: Update {chosen[i % len(chosen)]} translation",
+                {
+                    f"{chosen[i % len(chosen)]}/LC_MESSAGES/django.po": make_catalog(
+                        chosen[i % len(chosen)], strings, translated=0.7 + i / 1e6
+                    )
+                },
+            )
+            for i in range(1, min(commits, 200))
+        ],
+    )
+
+    pinned = {
+        name: git(
+            "rev-parse", f"master~{behind}", cwd=paths[f"{name}_upstream"]
+        ).strip()
+        for name in ("kumascript", "locale")
+    }
+    gitmodules = "".join(
+        f'[submodule "{name}"]\n'
+        f"\tpath = {name}\n"
+        f"\turl = {paths[f'{name}_upstream']}\n"
+        for name in ("kumascript", "locale")
+    )
+    initial = {
+        "README.md": b"# Kuma\n",
+        ".gitmodules": gitmodules.encode(),
+        "kuma/settings/common.py": b"PUENTE = {\n    'VERSION': '2019.01',\n}\n",
+        "kumascript": pinned["kumascript"],
+        "locale": pinned["locale"],
+    }
+    for i in range(200):
+        initial[f"kuma/app{i}.py"] = f"_('String number {i}')\n".encode()
+        initial[f"kuma/templates/page{i}.html"] = f"{{{{ _('Page {i}') }}}}\n".encode()
+    fast_import(
+        paths["kuma_upstream"],
+        [("Initial commit", initial)]
+        + [
+            (
+                f"Merge pull request #{i} from someone/branch-{i}",
+                {f"kuma/app{i % 200}.py": f"_('String number {i}')\n".encode()},
+            )
+            for i in range(1, commits)
+        ],
+    )
+    git("init", "-q", "--bare", "--initial-branch=master", paths["fork"])
+
+    git("clone", "-q", "--recurse-submodules", paths["kuma_upstream"], paths["kuma"])
+    git("remote", "add", "fork", paths["fork"], cwd=paths["kuma"])
+    # Like a checkout that was last updated when the submodules were pinned,
+    # so there's something to fetch and pull.
+    for name, sha in pinned.items():
+        submodule = os.path.join(paths["kuma"], name)
+        git("checkout", "-q", "-B", "master", sha, cwd=submodule)
+        git("update-ref", "refs/remotes/origin/master", sha, cwd=submodule)
+    return paths
+
+
+def published_tags(git_dir, count=None):
+    """Return Docker Hub like tags, newest first, for the commits of the
+    master branch. The tag names are the short shas."""
+    args = ["log", "--format=%h %ct", "--abbrev=7", "master"]
+    if count:
+        args.append(f"-n{count}")
+    tags = []
+    for line in git(*args, cwd=git_dir).splitlines():
+        short_sha, timestamp = line.split()
+        tags.append(
+            {
+                "name": short_sha,
+                "last_updated": datetime.datetime.utcfromtimestamp(
+                    int(timestamp)
+                ).isoformat()
+                + "Z",
+                "digest": f"sha256:{short_sha * 9}"[:71],
+            }
+        )
+    return tags
@@ -0,0 +1,325 @@
+"""Time kuma-deployer's commands, end to end, against a generated Kuma
+checkout (see fixture.py) and local stand-ins for Docker Hub, GitHub and
+revision.txt (see standins.py). Nothing touches the network.
+
+    python benchmarks/run.py --help
+
+Every run is saved in benchmarks/results/ and compared with the last saved
+run that used the same parameters.
+"""
+
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import click
+
+from fixture import GIT_ENV, make_catalog, make_fixture, published_tags
+from standins import StandIns
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "results")
+
+# Name -> function that, given the fixture paths, the config and the
+# stand-ins, does all the (untimed) preparation and returns the function to
+# time.
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return decorator
+
+
+@benchmark("selfcheck")
+def bench_selfcheck(paths, config, standins):
+    from deployer.selfish import self_check
+
+    return lambda: self_check(paths["kuma"], config)
+
+
+@benchmark("submodules")
+def bench_submodules(paths, config, standins):
+    from deployer.submodules import make_submodules_pr
+
+    return lambda: make_submodules_pr(paths["kuma"], config)
+
+
+@benchmark("checkbuilds")
+def bench_checkbuilds(paths, config, standins):
+    from deployer.checker import check_builds
+
+    return lambda: check_builds(paths["kuma"], config, wait=True, timeout=10)
+
+
+@benchmark("stagepush")
+def bench_stagepush(paths, config, standins):
+    from deployer.push import stage_push
+
+    return lambda: stage_push(paths["kuma"], config, watch=False)
+
+
+@benchmark("prodpush")
+def bench_prodpush(paths, config, standins):
+    from deployer.push import prod_push
+
+    return lambda: prod_push(paths["kuma"], config, watch=False)
+
+
+@benchmark("watch")
+def bench_watch(paths, config, standins):
+    from deployer.watcher import watch_endpoints
+
+    urls = [f"{standins.url}/revision/{name}.txt" for name in ("stage", "prod")]
+    return lambda: watch_endpoints(urls, sleep_seconds=0.01, max_sleep_seconds=0.05)
+
+
+@benchmark("l10n-diff")
+def bench_l10n_diff(paths, config, standins):
+    """What 'l10n' does with the output of 'make localerefresh'."""
+    import git
+
+    from deployer import pocatalog
+    from deployer.localerefresh import (
+        commit_with_message,
+        scan_diff,
+        scan_untracked,
+        stage_paths,
+    )
+
+    locale_repo = git.Repo(os.path.join(paths["kuma"], "locale"))
+    locale_repo.heads["master"].checkout()
+    # Pretend the extraction found more strings and some translations
+    # changed, in every catalog.
+    for path in glob.glob(os.path.join(locale_repo.working_dir, "*/LC_MESSAGES/*.po")):
+        locale = os.path.relpath(path, locale_repo.working_dir).split("/")[0]
+        with open(path, "rb") as f:
+            strings = f.read().count(b"\n#: ")
+        with open(path, "wb") as f:
+            f.write(make_catalog(locale, strings + 50, translated=0.75))
+    os.makedirs(os.path.join(locale_repo.working_dir, "new"))
+    with open(os.path.join(locale_repo.working_dir, "new", "notes.txt"), "w") as f:
+        f.write("untracked\n")
+
+    def run():
+        scanned = scan_diff(locale_repo)
+        after = pocatalog.catalog_index(locale_repo)
+        compared = pocatalog.compare(
+            pocatalog.catalog_index(locale_repo, "HEAD"), after
+        )
+        pocatalog.coverage(after)
+        scan_untracked(locale_repo)
+        stage_paths(locale_repo, scanned["added"] + scanned["removed"])
+        new_msgids = sorted(pocatalog.format_key(key) for key in compared["added"])
+        commit_with_message(locale_repo, "\n".join(["Update strings", ""] + new_msgids))
+
+    return run
+
+
+def _version():
+    try:
+        return (
+            subprocess.run(
+                ["git", "describe", "--always", "--dirty"],
+                cwd=HERE,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            .stdout.decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous_results(parameters):
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), reverse=True):
+        with open(path) as f:
+            results = json.load(f)
+        if results["parameters"] == parameters:
+            return path, results
+    return None, None
+
+
+@click.command()
+@click.option("--commits", default=2000, show_default=True, help="history per repo")
+@click.option("--locales", default=30, show_default=True, help="number of locales")
+@click.option(
+    "--strings", default=2000, show_default=True, help="entries per PO catalog"
+)
+@click.option(
+    "--behind",
+    default=20,
+    show_default=True,
+    help="how many commits the submodules are behind upstream",
+)
+@click.option("--repeat", default=3, show_default=True, help="runs per benchmark")
+@click.option(
+    "--only",
+    multiple=True,
+    type=click.Choice(sorted(BENCHMARKS)),
+    help="only run these benchmarks",
+)
+@click.option("--no-save", is_flag=True, help="don't save the results")
+@click.option("--verbose", is_flag=True, help="show the output of the commands")
+def main(commits, locales, strings, behind, repeat, only, no_save, verbose):
+    parameters = {
+        "commits": commits,
+        "locales": locales,
+        "strings": strings,
+        "behind": behind,
+    }
+    workdir = tempfile.mkdtemp(prefix="kuma-deployer-bench-")
+    standins = StandIns()
+    url = standins.start()
+
+    # The deployer reads its configuration when it's imported.
+    cache_dir = os.path.join(workdir, "cache")
+    os.environ.update(GIT_ENV)
+    os.environ.update(
+        {
+            "GITHUB_ACCESS_TOKEN": "benchmark",
+            "DEPLOYER_CACHE_DIR": cache_dir,
+            "DEPLOYER_DOCKER_HUB_API_URL": f"{url}/v2/repositories",
+            "DEPLOYER_GITHUB_API_URL": url,
+        }
+    )
+    from deployer.constants import KUMA_IMAGE_NAME, KUMASCRIPT_IMAGE_NAME
+
+    config = {
+        "debug": False,
+        "master_branch": "master",
+        "upstream_name": "origin",
+        "submodules_upstream_name": "origin",
+        "your_remote_name": "fork",
+        "fetch_depth": 0,
+    }
+    timings = {}
+    errors = {}
+    try:
+        for name in only or BENCHMARKS:
+            timings[name] = []
+            for i in range(repeat):
+                root = os.path.join(workdir, f"{name}-{i}")
+                t0 = time.perf_counter()
+                paths = make_fixture(root, **parameters)
+                fixture_seconds = time.perf_counter() - t0
+                standins.reset(
+                    {
+                        KUMA_IMAGE_NAME: published_tags(paths["kuma_upstream"]),
+                        KUMASCRIPT_IMAGE_NAME: published_tags(
+                            paths["kumascript_upstream"]
+                        ),
+                    }
+                )
+                # Every run starts cold.
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                config["kumarepo"] = paths["kuma"]
+
+                fn = BENCHMARKS[name](paths, config, standins)
+                output = io.StringIO()
+                # Answer yes to every prompt.
+                stdin = io.StringIO("y\n" * 100)
+                with contextlib.ExitStack() as stack:
+                    stack.enter_context(_replace_stdin(stdin))
+                    if not verbose:
+                        stack.enter_context(contextlib.redirect_stdout(output))
+                    t0 = time.perf_counter()
+                    try:
+                        fn()
+                    except Exception:
+                        errors[name] = traceback.format_exc()
+                    seconds = time.perf_counter() - t0
+                if name in errors:
+                    click.echo(output.getvalue())
+                    click.echo(errors[name], err=True)
+                    break
+                timings[name].append(seconds)
+                click.echo(
+                    f"{name:<12} run {i + 1}: {seconds:8.3f}s "
+                    f"(fixture took {fixture_seconds:.1f}s)"
+                )
+                shutil.rmtree(root)
+    finally:
+        standins.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "version": _version(),
+        "date": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "git": subprocess.run(["git", "--version"], stdout=subprocess.PIPE)
+        .stdout.decode("utf-8")
+        .strip(),
+        "parameters": parameters,
+        "benchmarks": {
+            name: {
+                "runs": runs,
+                "min": min(runs),
+                "median": statistics.median(runs),
+            }
+            for name, runs in timings.items()
+            if runs and name not in errors
+        },
+        "errors": sorted(errors),
+    }
+
+    previous_path, previous = _previous_results(parameters)
+    click.echo("")
+    click.echo(
+        f"{'BENCHMARK':<12} {'MEDIAN':>9} {'MIN':>9} {'PREVIOUS':>9} {'CHANGE':>8}"
+    )
+    for name, numbers in results["benchmarks"].items():
+        line = f"{name:<12} {numbers['median']:8.3f}s {numbers['min']:8.3f}s"
+        before = previous and previous["benchmarks"].get(name)
+        if before:
+            change = (numbers["median"] - before["median"]) / before["median"]
+            line += f" {before['median']:8.3f}s {change:+8.1%}"
+        click.echo(line)
+    if previous_path:
+        click.echo(f"(compared with {os.path.relpath(previous_path)})")
+    for name in results["errors"]:
+        click.echo(f"{name:<12} FAILED", err=True)
+
+    if not no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        filename = os.path.join(
+            RESULTS_DIR,
+            f"{datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-"
+            f"{results['version'] or 'unknown'}.json",
+        )
+        with open(filename, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        click.echo(f"Saved {os.path.relpath(filename)}")
+    if errors:
+        sys.exit(1)
+
+
+@contextlib.contextmanager
+def _replace_stdin(stdin):
+    original = sys.stdin
+    sys.stdin = stdin
+    try:
+        yield
+    finally:
+        sys.stdin = original
+
+
+if __name__ == "__main__":
+    main()
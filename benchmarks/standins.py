@@ -0,0 +1,153 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Just enough of Docker Hub's tags API, GitHub's REST API and revision.txt
+# endpoints for kuma-deployer to talk to, on one local port.
+TAGS_RE = re.compile(r"^/v2/repositories/([^/]+/[^/]+)/tags/?$")
+TAG_RE = re.compile(r"^/v2/repositories/([^/]+/[^/]+)/tags/([^/]+)/?$")
+REPO_RE = re.compile(r"^/repos/([^/]+/[^/]+)/?$")
+PULLS_RE = re.compile(r"^/repos/([^/]+/[^/]+)/pulls/?$")
+REVISION_RE = re.compile(r"^/revision/([^/]+)\.txt$")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, headers=None, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def base_url(self):
+        return f"http://{self.headers['Host']}"
+
+    def do_GET(self):
+        standins = self.server.standins
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        match = TAG_RE.match(url.path)
+        if match:
+            tag = standins.tags.get(match.group(1), {}).get(match.group(2))
+            if not tag:
+                return self.send_body(404, {"message": "Not found"})
+            etag = f'"{tag["digest"]}"'
+            if self.headers.get("If-None-Match") == etag:
+                return self.send_body(304, b"", {"ETag": etag})
+            return self.send_body(200, tag, {"ETag": etag})
+
+        match = TAGS_RE.match(url.path)
+        if match:
+            # Newest first, like with ordering=last_updated.
+            tags = list(standins.tags.get(match.group(1), {}).values())
+            page = int(query.get("page", ["1"])[0])
+            page_size = int(query.get("page_size", ["10"])[0])
+            start = (page - 1) * page_size
+            results = tags[start:][:page_size]
+            next_url = None
+            if page * page_size < len(tags):
+                next_url = (
+                    f"{self.base_url()}{url.path}?page={page + 1}"
+                    f"&page_size={page_size}&ordering=last_updated"
+                )
+            return self.send_body(
+                200, {"count": len(tags), "next": next_url, "results": results}
+            )
+
+        match = REPO_RE.match(url.path)
+        if match:
+            full_name = match.group(1)
+            return self.send_body(
+                200,
+                {
+                    "id": 1,
+                    "name": full_name.split("/")[1],
+                    "full_name": full_name,
+                    "url": f"{self.base_url()}/repos/{full_name}",
+                    "html_url": f"https://github.com/{full_name}",
+                },
+            )
+
+        if PULLS_RE.match(url.path):
+            return self.send_body(200, standins.open_pulls)
+
+        match = REVISION_RE.match(url.path)
+        if match:
+            # The content changes every `revision_every` requests, as if
+            # something was deployed.
+            with standins.lock:
+                count = standins.revision_requests.get(match.group(1), 0)
+                standins.revision_requests[match.group(1)] = count + 1
+            body = f"{match.group(1)}-{count // standins.revision_every}\n"
+            return self.send_body(200, body.encode(), content_type="text/plain")
+
+        self.send_body(404, {"message": "Not found"})
+
+    def do_POST(self):
+        standins = self.server.standins
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        match = PULLS_RE.match(url.path)
+        if match:
+            with standins.lock:
+                standins.created_pulls.append(body)
+                number = len(standins.created_pulls)
+            full_name = match.group(1)
+            return self.send_body(
+                201,
+                {
+                    "number": number,
+                    "title": body.get("title"),
+                    "state": "open",
+                    "merged": False,
+                    "url": f"{self.base_url()}/repos/{full_name}/pulls/{number}",
+                    "html_url": f"https://github.com/{full_name}/pull/{number}",
+                },
+            )
+        self.send_body(404, {"message": "Not found"})
+
+
+class StandIns:
+    """Serve the stand-ins from a background thread. `tags` is a dict of
+    image name -> dict of tag name -> tag, newest first."""
+
+    def __init__(self, revision_every=3):
+        self.tags = {}
+        self.open_pulls = []
+        self.created_pulls = []
+        self.revision_requests = {}
+        self.revision_every = revision_every
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.standins = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self, tags):
+        with self.lock:
+            self.tags = {
+                image_name: {tag["name"]: tag for tag in image_tags}
+                for image_name, image_tags in tags.items()
+            }
+            self.created_pulls = []
+            self.revision_requests = {}
@@ -1,11 +1,24 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import git
-import requests
 
-from .utils import warning, info, success
-from .exceptions import MasterBranchError
+from . import resolver
+from .constants import DOCKER_HUB_API_URL, KUMA_IMAGE_NAME, KUMASCRIPT_IMAGE_NAME
+from .httpcache import cached_get
+from .utils import warning, info, success, humanize_seconds
+from .exceptions import MasterBranchError, WaitTimeoutError
+from .tagindex import (
+    get_digest,
+    newest_published_ancestor,
+    published_commits,
+    sync_index,
+)
 
 
-def check_builds(repo_location, config):
+def check_builds(repo_location, config, wait=False, timeout=30 * 60):
     repo = git.Repo(repo_location)
     # Are you on the "master" branch?
     active_branch = repo.active_branch
@@ -15,36 +28,34 @@ def check_builds(repo_location, config):
             f"You're currently on the {active_branch.name!r} branch."
         )
 
-    # Check Kuma
-    sha = repo.head.object.hexsha
-    short_sha = repo.git.rev_parse(sha, short=7)
-    info(f"Looking for Kuma short sha {short_sha}")
-    public_url = "https://hub.docker.com/r/mdnwebdocs/kuma/tags"
-    api_url = "https://registry.hub.docker.com/v2/repositories/mdnwebdocs/kuma/tags/"
-    response = requests.get(api_url)
-    response.raise_for_status()
-    published_shas = [result["name"] for result in response.json()["results"]]
-    if short_sha in published_shas:
-        success(f"Kuma sha {short_sha} is on {public_url}")
-    else:
-        warning(f"Could not find {short_sha} on {public_url} :(")
-
-    # Check Kumascript
+    short_sha = resolver.short_sha(repo)
     ks_repo = repo.submodules["kumascript"].module()
-    sha = ks_repo.head.object.hexsha
-    ks_short_sha = ks_repo.git.rev_parse(sha, short=7)
+    ks_short_sha = resolver.short_sha(ks_repo)
+
+    # Check Kuma and Kumascript at the same time
+    info(f"Looking for Kuma short sha {short_sha}")
     info(f"Looking for Kumascript short sha {ks_short_sha}")
-    public_url = "https://hub.docker.com/r/mdnwebdocs/kumascript/tags"
-    api_url = (
-        "https://registry.hub.docker.com/v2/repositories/mdnwebdocs/kumascript/tags/"
+    kuma_lookup, ks_lookup = lookup_tags(
+        [(KUMA_IMAGE_NAME, short_sha), (KUMASCRIPT_IMAGE_NAME, ks_short_sha)]
     )
-    response = requests.get(api_url)
-    response.raise_for_status()
-    published_shas = [result["name"] for result in response.json()["results"]]
-    if ks_short_sha in published_shas:
-        success(f"Kumascript sha {ks_short_sha} is on {public_url}")
-    else:
-        warning(f"Could not find {ks_short_sha} on {public_url} :(")
+    _report_lookup("Kuma", KUMA_IMAGE_NAME, repo, short_sha, kuma_lookup)
+    _report_lookup(
+        "Kumascript", KUMASCRIPT_IMAGE_NAME, ks_repo, ks_short_sha, ks_lookup
+    )
+
+    if wait:
+        waiting = []
+        if not kuma_lookup["published"]:
+            waiting.append((KUMA_IMAGE_NAME, short_sha))
+        if not ks_lookup["published"]:
+            waiting.append((KUMASCRIPT_IMAGE_NAME, ks_short_sha))
+        if waiting:
+            print("")
+            wait_for_tags(waiting, timeout)
+        # The images are pushed to Docker Hub by Jenkins so there's no need
+        # to ask about Jenkins too.
+        success("Both images are published. There is hope in this world!")
+        return
 
     print("")
 
@@ -73,3 +84,104 @@ def check_builds(repo_location, config):
         warning("Hmm... Not sure what to think about that. Try in a couple of minutes?")
         return
     success("Great!\nThere is hope in this world!")
+
+
+def lookup_tags(lookups):
+    """Return a list of dicts like {"published": bool, "digest": str or None},
+    one for each (image_name, tag) tuple in `lookups`, in the same order.
+
+    Each tag is asked for directly, all at the same time. So it costs one
+    round-trip no matter how many tags the images have had published since.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(lookups), 1)) as executor:
+        futures = [
+            executor.submit(_lookup_tag, image_name, tag) for image_name, tag in lookups
+        ]
+        return [future.result() for future in futures]
+
+
+def _lookup_tag(image_name, tag):
+    # If nothing has changed since last time, this is a cheap 304.
+    response = cached_get(f"{DOCKER_HUB_API_URL}/{image_name}/tags/{tag}/")
+    lookup = {"published": False, "digest": None}
+    if response.status_code != 404:
+        response.raise_for_status()
+        lookup["published"] = True
+        lookup["digest"] = get_digest(response.json())
+    return lookup
+
+
+def wait_for_tags(lookups, timeout, min_interval=2.0, max_interval=60.0):
+    """Poll for every (image_name, tag) in `lookups` at the same time until
+    they're all published. Returns a list of dicts like
+    {"published": True, "digest": ...} as soon as the last one shows up or
+    raises WaitTimeoutError after `timeout` seconds.
+
+    Each tag is polled with its own "decorrelated jitter" backoff: it starts
+    at `min_interval` and grows towards `max_interval`.
+    """
+    deadline = time.time() + timeout
+    # If one of them fails there's no point in waiting for the others.
+    failed = threading.Event()
+
+    def wait_for_tag(image_name, tag):
+        try:
+            return _wait_for_tag(image_name, tag)
+        except Exception:
+            failed.set()
+            raise
+
+    def _wait_for_tag(image_name, tag):
+        interval = min_interval
+        while True:
+            lookup = _lookup_tag(image_name, tag)
+            if lookup["published"]:
+                success(f"{image_name}:{tag} is published!")
+                return lookup
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise WaitTimeoutError(
+                    f"Gave up waiting for {image_name}:{tag} after "
+                    f"{humanize_seconds(timeout)}"
+                )
+            interval = min(max_interval, random.uniform(min_interval, interval * 3))
+            # Never sleep past the deadline, so there's always one last check.
+            if failed.wait(min(interval, remaining)):
+                return None
+
+    info(
+        f"Waiting (at most {humanize_seconds(timeout)}) for "
+        + " and ".join(f"{image_name}:{tag}" for image_name, tag in lookups)
+    )
+    with ThreadPoolExecutor(max_workers=len(lookups)) as executor:
+        futures = [
+            executor.submit(wait_for_tag, image_name, tag)
+            for image_name, tag in lookups
+        ]
+        return [future.result() for future in futures]
+
+
+def _report_lookup(label, image_name, repo, short_sha, lookup, history=5):
+    public_url = f"https://hub.docker.com/r/{image_name}/tags"
+    if lookup["published"]:
+        success(f"{label} sha {short_sha} is on {public_url}")
+        if lookup["digest"]:
+            info(f"\t{lookup['digest']}")
+        return
+
+    warning(f"Could not find {short_sha} on {public_url} :(")
+    # Only the history questions need the (synced) index of all the tags.
+    index = sync_index(image_name)
+    info(f"The last {history} {label} commits:")
+    for commit, tag in published_commits(index, repo, max_count=history):
+        info(
+            f"\t{commit.hexsha[:7]}  {'published' if tag else 'not published':<14}",
+            commit.summary[:60],
+        )
+    ancestor = newest_published_ancestor(index, repo)
+    if ancestor:
+        commit, tag, distance = ancestor
+        info(
+            f"Newest published {label} ancestor is {tag} "
+            f"({distance} commit{'s' if distance > 1 else ''} behind)"
+        )
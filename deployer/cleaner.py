@@ -1,10 +1,16 @@
+import tempfile
+
+import click
 import git
-from github import Github, GithubException
 
-from .constants import GITHUB_ACCESS_TOKEN, KUMA_REPO_NAME
-from .exceptions import DirtyRepoError
+from .constants import GITHUB_ACCESS_TOKEN, GITHUB_GRAPHQL_URL, KUMA_REPO_NAME
+from .exceptions import DirtyRepoError, GitHubQueryError
+from .httpcache import get_session
 from .utils import info, success, warning
 
+# The branches that `submodules` and `l10n` create.
+BRANCH_PREFIXES = ("pre-push-", "locale-update-")
+
 
 def start_cleaner(repo_location, config):
     repo = git.Repo(repo_location)
@@ -15,24 +21,150 @@ def start_cleaner(repo_location, config):
             f"Run `git status` inside {repo_location} to see what's up."
         )
 
-    # XXX I'd like to move away from branches and switch to tags.
-    # But for now, just to check sanity do a-something.
-    active_branch = repo.active_branch
-    if active_branch.name.startswith("pre-push"):
-        # Find its pull request and see if it's merged
-        g = Github(GITHUB_ACCESS_TOKEN)
-        g_repo = g.get_repo(KUMA_REPO_NAME)
-
-        pulls = g_repo.get_pulls(
-            sort="created",
-            direction="desc",
-            state="closed",
-            head=active_branch.name,
-            base="master",
+    remote_name = config["your_remote_name"]
+    # So that what we decide to delete is based on what's there now.
+    repo.git.fetch("--prune", remote_name)
+    local_branches = _list_branches(repo, "refs/heads/")
+    remote_branches = _list_branches(repo, f"refs/remotes/{remote_name}/")
+    names = sorted(set(local_branches) | set(remote_branches))
+    if not names:
+        success("No pre-push or locale-update branches to clean up.")
+        return
+
+    info(f"Looking up the pull requests of {_branches(names)}")
+    merged = find_merged(names)
+
+    # Only ever delete a branch if it points to exactly what was merged.
+    # If it doesn't, someone has added to it since.
+    active_branch = repo.active_branch.name
+    delete_local = {}
+    for name, sha in sorted(local_branches.items()):
+        if sha not in merged.get(name, ()):
+            continue
+        if name == active_branch:
+            warning(f"Not deleting {name!r} because it's checked out.")
+            continue
+        delete_local[name] = sha
+    delete_remote = {
+        name: sha
+        for name, sha in sorted(remote_branches.items())
+        if sha in merged.get(name, ())
+    }
+    if not delete_local and not delete_remote:
+        success("None of the branches have been merged.")
+        return
+
+    if delete_local:
+        info(f"Found {_branches(delete_local, 'merged local ')}:")
+        for name in delete_local:
+            info(f"\t{name}")
+        if click.confirm("Delete them?", default=True):
+            delete_branches(repo, delete_local)
+            success(f"Deleted {_branches(delete_local, 'local ')}.")
+
+    if delete_remote:
+        info(f"Found {_branches(delete_remote, 'merged ')} on {remote_name!r}:")
+        for name in delete_remote:
+            info(f"\t{name}")
+        if click.confirm(f"Delete them from {remote_name!r}?", default=True):
+            delete_remote_branches(repo, remote_name, delete_remote)
+            success(f"Deleted {_branches(delete_remote)} from {remote_name!r}.")
+
+
+def _branches(branches, kind=""):
+    if len(branches) == 1:
+        return f"1 {kind}branch"
+    return f"{len(branches):,} {kind}branches"
+
+
+def _list_branches(repo, prefix):
+    """Return a dict of branch name -> sha of the branches (under `prefix`)
+    that we would have created."""
+    branches = {}
+    for line in repo.git.for_each_ref(
+        "--format=%(objectname) %(refname)",
+        *[f"{prefix}{branch_prefix}*" for branch_prefix in BRANCH_PREFIXES],
+    ).splitlines():
+        sha, refname = line.split(" ", 1)
+        branches[refname.replace(prefix, "", 1)] = sha
+    return branches
+
+
+def find_merged(names, batch_size=50):
+    """Return a dict of branch name -> set of the head shas of the merged
+    pull requests from a branch of that name. One GraphQL query, with one
+    alias per branch, covers `batch_size` branches at a time."""
+    owner, name = KUMA_REPO_NAME.split("/")
+    merged = {}
+    remaining = list(names)
+    while remaining:
+        batch, remaining = remaining[:batch_size], remaining[batch_size:]
+        aliases = [
+            f"b{j}: pullRequests(headRefName: $b{j}, states: MERGED, first: 10) "
+            "{ nodes { headRefOid } }"
+            for j in range(len(batch))
+        ]
+        query = (
+            "query($owner: String!, $name: String!, "
+            + ", ".join(f"$b{j}: String!" for j in range(len(batch)))
+            + ") { repository(owner: $owner, name: $name) { "
+            + " ".join(aliases)
+            + " } }"
+        )
+        variables = {"owner": owner, "name": name}
+        variables.update({f"b{j}": branch for j, branch in enumerate(batch)})
+        response = get_session().post(
+            GITHUB_GRAPHQL_URL,
+            json={"query": query, "variables": variables},
+            headers={"Authorization": f"bearer {GITHUB_ACCESS_TOKEN}"},
         )
-        raise NotImplementedError("this doesn't work.")
-        # Seems it always returns everything
-        for pr in pulls:
-            print(pr.number, pr.title, pr.head.ref, pr.base.ref, pr.merged)
-            # print(dir(pr))
-            # break
+        response.raise_for_status()
+        result = response.json()
+        if result.get("errors"):
+            raise GitHubQueryError(
+                "; ".join(error["message"] for error in result["errors"])
+            )
+        repository = result["data"]["repository"]
+        for j, branch in enumerate(batch):
+            shas = {node["headRefOid"] for node in repository[f"b{j}"]["nodes"]}
+            if shas:
+                merged[branch] = shas
+    return merged
+
+
+def delete_branches(repo, branches):
+    """Delete these local branches (name -> sha) in one ref transaction. It's
+    all or nothing and a branch that isn't at that sha any more fails it."""
+    commands = "".join(
+        f"delete refs/heads/{name} {sha}\n" for name, sha in branches.items()
+    )
+    with tempfile.TemporaryFile() as f:
+        f.write(commands.encode("utf-8"))
+        f.seek(0)
+        repo.git.update_ref("--stdin", istream=f)
+    # Unlike `git branch -D`, update-ref leaves any config of the branches.
+    # The lines are like "branch.{name}.remote origin".
+    sections = {
+        line.split(" ", 1)[0].split(".", 1)[1].rsplit(".", 1)[0]
+        for line in repo.git.config(
+            "--get-regexp", r"^branch\.", with_exceptions=False
+        ).splitlines()
+    }
+    for name in branches:
+        if name in sections:
+            repo.git.config("--remove-section", f"branch.{name}")
+
+
+def delete_remote_branches(repo, remote_name, branches):
+    """Delete these branches (name -> sha) from the remote in one push. Every
+    deletion is leased on that sha and the push is atomic, so if anybody has
+    pushed to any of them since, nothing is deleted."""
+    repo.git.push(
+        "--atomic",
+        *[
+            f"--force-with-lease=refs/heads/{name}:{sha}"
+            for name, sha in branches.items()
+        ],
+        remote_name,
+        *[f":refs/heads/{name}" for name in branches],
+    )
@@ -1,7 +1,7 @@
 import getpass
 import os
 
-from decouple import AutoConfig
+from decouple import AutoConfig, Csv
 
 config = AutoConfig(os.curdir)
 
@@ -10,8 +10,15 @@ def _current_user():
     return getpass.getuser()
 
 
+CACHE_DIR = config(
+    "DEPLOYER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "kuma-deployer"),
+)
+
 GITHUB_ACCESS_TOKEN = config("GITHUB_ACCESS_TOKEN")
 KUMA_REPO_NAME = config("DEPLOYER_KUMA_REPO_NAME", "mozilla/kuma")  # about to change!
+GITHUB_API_URL = config("DEPLOYER_GITHUB_API_URL", "https://api.github.com")
+GITHUB_GRAPHQL_URL = config("DEPLOYER_GITHUB_GRAPHQL_URL", f"{GITHUB_API_URL}/graphql")
 
 DEFAULT_MASTER_BRANCH = config("DEPLOYER_DEFAULT_MASTER_BRANCH", "master")
 DEFAULT_UPSTREAM_NAME = config("DEPLOYER_DEFAULT_UPSTREAM_NAME", "origin")
@@ -20,6 +27,11 @@ DEFAULT_SUBMODULES_UPSTREAM_NAME = config(
 )
 DEFAULT_YOUR_REMOTE_NAME = config("DEPLOYER_DEFAULT_YOUR_REMOTE_NAME", _current_user())
 
+# Opt-in leaner transfers. A depth (e.g. 50) makes new submodule clones
+# shallow and a filter (e.g. "blob:none") is what `partialclone` configures.
+DEFAULT_FETCH_DEPTH = config("DEPLOYER_DEFAULT_FETCH_DEPTH", 0, cast=int)
+DEFAULT_FETCH_FILTER = config("DEPLOYER_DEFAULT_FETCH_FILTER", "blob:none")
+
 WHATSDEPLOYED_URL = config(
     "DEPLOYER_WHATSDEPLOYED_URL", "https://whatsdeployed.io/s/HC0/mozilla/kuma"
 )
@@ -29,3 +41,25 @@ STAGE_INTEGRATIONTEST_BRANCH = config(
 )
 PROD_PUSH_BRANCH = config("DEPLOYER_PROD_PUSH_BRANCH", "prod-push")
 STANDBY_PUSH_BRANCH = config("DEPLOYER_STANDBY_PUSH_BRANCH", "standby-push")
+
+DOCKER_HUB_API_URL = config(
+    "DEPLOYER_DOCKER_HUB_API_URL", "https://registry.hub.docker.com/v2/repositories"
+)
+KUMA_IMAGE_NAME = config("DEPLOYER_KUMA_IMAGE_NAME", "mdnwebdocs/kuma")
+KUMASCRIPT_IMAGE_NAME = config(
+    "DEPLOYER_KUMASCRIPT_IMAGE_NAME", "mdnwebdocs/kumascript"
+)
+
+# All the endpoints that need to have switched before a deploy is complete.
+STAGE_WATCH_URLS = config(
+    "DEPLOYER_STAGE_WATCH_URLS",
+    "https://developer.allizom.org/media/revision.txt,"
+    "https://developer.allizom.org/media/kumascript-revision.txt",
+    cast=Csv(),
+)
+PROD_WATCH_URLS = config(
+    "DEPLOYER_PROD_WATCH_URLS",
+    "https://developer.mozilla.org/media/revision.txt,"
+    "https://developer.mozilla.org/media/kumascript-revision.txt",
+    cast=Csv(),
+)
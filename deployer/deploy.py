@@ -0,0 +1,237 @@
+import datetime
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import git
+
+from . import resolver
+from .checker import check_builds
+from .constants import (
+    KUMA_IMAGE_NAME,
+    KUMA_REPO_NAME,
+    KUMASCRIPT_IMAGE_NAME,
+    PROD_WATCH_URLS,
+    STAGE_WATCH_URLS,
+)
+from .exceptions import DeployStepError
+from .httpcache import get_github
+from .push import center, prod_push, stage_push, watch_pushed
+from .selfish import self_check
+from .submodules import make_submodules_pr
+from .tagindex import sync_indexes
+from .utils import checkout_cache_path, info, success, warning, write_json
+
+
+def _journal_path(repo_location):
+    # One journal per Kuma checkout.
+    return checkout_cache_path("journals", repo_location)
+
+
+def load_journal(repo_location):
+    try:
+        with open(_journal_path(repo_location)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_journal(repo_location, journal):
+    write_json(_journal_path(repo_location), journal, indent=1, sort_keys=True)
+
+
+def _current_shas(repo_location):
+    repo = git.Repo(repo_location)
+    ks_repo = repo.submodules["kumascript"].module()
+    return {"kuma": repo.head.object.hexsha, "kumascript": ks_repo.head.object.hexsha}
+
+
+# Every step is (name, the names of the steps it requires, read-only?).
+# Read-only steps that are ready at the same time are run concurrently.
+STEPS = (
+    ("selfcheck", (), True),
+    ("sync-tags", (), True),
+    ("submodules", ("selfcheck",), False),
+    ("pr-merged", ("submodules",), False),
+    ("checkbuilds", ("pr-merged", "sync-tags"), True),
+    ("stagepush", ("checkbuilds",), False),
+    ("stage-watch", ("stagepush",), True),
+    ("prodpush", ("stage-watch",), False),
+    ("prod-watch", ("prodpush",), True),
+)
+# The steps that check, or push, the HEADs as they were when they ran.
+# They have to be done again if the HEADs have moved since.
+SHA_STEPS = (
+    "selfcheck",
+    "checkbuilds",
+    "stagepush",
+    "stage-watch",
+    "prodpush",
+    "prod-watch",
+)
+
+
+def start_deploy(repo_location, config, restart=False):
+    journal = load_journal(repo_location)
+    if journal and not restart and len(journal["steps"]) < len(STEPS):
+        info(f"Resuming the deploy started {journal['started']}")
+        for name, step in sorted(journal["steps"].items(), key=lambda x: x[1]["done"]):
+            info(f"\t{name:<12} done {step['done']}")
+        _forget_outdated_steps(repo_location, journal)
+    else:
+        journal = {"started": _now(), "steps": {}}
+        save_journal(repo_location, journal)
+
+    runners = {
+        "selfcheck": _step_selfcheck,
+        "sync-tags": _step_sync_tags,
+        "submodules": _step_submodules,
+        "pr-merged": _step_pr_merged,
+        "checkbuilds": _step_checkbuilds,
+        "stagepush": _step_stagepush,
+        "stage-watch": _step_stage_watch,
+        "prodpush": _step_prodpush,
+        "prod-watch": _step_prod_watch,
+    }
+
+    while len(journal["steps"]) < len(STEPS):
+        ready = [
+            (name, read_only)
+            for name, requires, read_only in STEPS
+            if name not in journal["steps"]
+            and all(x in journal["steps"] for x in requires)
+        ]
+        concurrent = [name for name, read_only in ready if read_only]
+        if len(concurrent) > 1:
+            batch = concurrent
+        else:
+            # Anything that changes something, or prompts, is run by itself.
+            batch = [ready[0][0]]
+
+        center(f"DEPLOY {', '.join(repr(x) for x in batch)}")
+        with ThreadPoolExecutor(max_workers=len(batch)) as executor:
+            futures = {
+                name: executor.submit(
+                    runners[name], repo_location, config, journal["steps"]
+                )
+                for name in batch
+            }
+        # Only record the ones that worked, so a rerun picks up from the
+        # first one that didn't.
+        exceptions = []
+        for name, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as exception:
+                exceptions.append(exception)
+                continue
+            journal["steps"][name] = {
+                "done": _now(),
+                "shas": _current_shas(repo_location),
+                "result": result,
+            }
+            save_journal(repo_location, journal)
+        if exceptions:
+            raise exceptions[0]
+
+    success("All done! 🎉")
+
+
+def _forget_outdated_steps(repo_location, journal):
+    """If the HEADs aren't what they were when the last step was done (e.g.
+    new commits landed in between), forget the steps that checked or pushed
+    the old ones, so they're done again with the current HEADs."""
+    if not journal["steps"]:
+        return
+    last = max(journal["steps"].values(), key=lambda step: step["done"])
+    current = _current_shas(repo_location)
+    if last["shas"] == current:
+        return
+    warning("The HEADs have moved since the last step was done:")
+    for name, sha in current.items():
+        info(f"\t{name:<12} {last['shas'].get(name, '?')[:7]} -> {sha[:7]}")
+    outdated = [name for name in SHA_STEPS if name in journal["steps"]]
+    if not outdated:
+        return
+    if not click.confirm(
+        f"Do {', '.join(repr(x) for x in outdated)} again with these HEADs?",
+        default=True,
+    ):
+        raise DeployStepError(
+            "Not resuming with unchecked HEADs. Use 'deploy --restart' to start over."
+        )
+    for name in outdated:
+        del journal["steps"][name]
+    save_journal(repo_location, journal)
+
+
+def _now():
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _step_selfcheck(repo_location, config, steps):
+    self_check(repo_location, config)
+
+
+def _step_sync_tags(repo_location, config, steps):
+    # Warm up the tag indexes so that, if a build isn't published yet,
+    # checkbuilds can show what is straight away.
+    sync_indexes([KUMA_IMAGE_NAME, KUMASCRIPT_IMAGE_NAME])
+
+
+def _step_submodules(repo_location, config, steps):
+    return make_submodules_pr(repo_location, config)
+
+
+def _step_pr_merged(repo_location, config, steps, sleep_seconds=30):
+    created = steps["submodules"]["result"]
+    if not created["updates"]:
+        info("No submodules were updated so there's no pull request to wait for.")
+    elif created["pr"]:
+        g = get_github()
+        pr = g.get_repo(KUMA_REPO_NAME).get_pull(created["pr"])
+        info(f"Waiting for {pr.html_url} to be merged")
+        while not pr.merged:
+            if pr.state == "closed":
+                raise DeployStepError(f"{pr.html_url} was closed without merging.")
+            time.sleep(sleep_seconds)
+            pr.update()
+        success(f"{pr.html_url} is merged.")
+    elif not click.confirm(
+        f"Has the pull request for {created['branch']!r} been merged?", default=True
+    ):
+        raise DeployStepError("Run deploy again when the pull request is merged.")
+
+    # Bring in the merge (or whatever else is new) and make the submodules
+    # match it, so the later steps check what will be pushed.
+    repo = git.Repo(repo_location)
+    repo.heads[config["master_branch"]].checkout()
+    repo.remotes[config["upstream_name"]].pull(config["master_branch"])
+    repo.git.submodule("update")
+    resolver.invalidate(repo)
+    for submodule in repo.submodules:
+        resolver.invalidate(submodule.module())
+    return {"pr": created["pr"]}
+
+
+def _step_checkbuilds(repo_location, config, steps):
+    check_builds(repo_location, config, wait=True)
+
+
+def _step_stagepush(repo_location, config, steps):
+    return stage_push(repo_location, config, watch=False)
+
+
+def _step_stage_watch(repo_location, config, steps):
+    return watch_pushed(STAGE_WATCH_URLS, steps["stagepush"]["result"])
+
+
+def _step_prodpush(repo_location, config, steps):
+    if not click.confirm("Stage looks good. Push to prod?", default=True):
+        raise DeployStepError("Not pushing to prod. Run deploy again when ready.")
+    return prod_push(repo_location, config, watch=False)
+
+
+def _step_prod_watch(repo_location, config, steps):
+    return watch_pushed(PROD_WATCH_URLS, steps["prodpush"]["result"])
@@ -6,6 +6,10 @@ class SubmoduleFindingError(CoreException):
     """when struggling to find the submodule."""
 
 
+class SubmoduleUpdateError(CoreException):
+    """when one or more submodules couldn't be updated"""
+
+
 class DirtyRepoError(CoreException):
     """dirty repo, d'uh"""
 
@@ -18,9 +22,37 @@ class PushBranchError(CoreException):
     """struggling to find the branch"""
 
 
+class PushError(CoreException):
+    """when a push didn't go all the way through"""
+
+
+class PartialCloneError(CoreException):
+    """when a repo can't be made a partial clone"""
+
+
+class GitHubQueryError(CoreException):
+    """when a GitHub GraphQL query comes back with errors"""
+
+
 class RemoteURLError(CoreException):
     """when a remote's URL isn't awesome"""
 
 
 class PuenteVersionError(CoreException):
     """when something's wrong trying to figure out the next puente version"""
+
+
+class WaitTimeoutError(CoreException):
+    """when waiting for something that never happened"""
+
+
+class NoWatchURLsError(CoreException):
+    """when there are no URLs to watch"""
+
+
+class CommandError(CoreException):
+    """when a command we ran exited with an error"""
+
+
+class DeployStepError(CoreException):
+    """when a step of the deploy can't be completed (yet)"""
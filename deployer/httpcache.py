@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from github import Github
+from requests.structures import CaseInsensitiveDict
+
+from .constants import CACHE_DIR, GITHUB_ACCESS_TOKEN, GITHUB_API_URL
+from .utils import requests_retry_session, write_json
+
+# Our own HTTP goes through one session so connections are kept alive, per
+# host, for as long as the command runs. GETs that can be revalidated are
+# cached on disk so a repeated command gets a cheap 304 instead of the whole
+# response. PyGithub has no way to be given a session so the GitHub REST API
+# calls made through it don't use either. They share one Github instance,
+# and so one connection pool, of their own.
+_lock = threading.Lock()
+_session = None
+_github = None
+
+
+def get_session():
+    """Return the shared requests session (with retries)."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests_retry_session(pool_maxsize=32)
+        return _session
+
+
+def get_github():
+    """Return the shared Github instance. It makes its requests with its own
+    connection pool, not the shared session, and nothing it gets is cached
+    on disk."""
+    global _github
+    with _lock:
+        if _github is None:
+            _github = Github(GITHUB_ACCESS_TOKEN, base_url=GITHUB_API_URL)
+        return _github
+
+
+def _cache_path(url):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, "http", key[:2], f"{key}.json")
+
+
+def cached_get(url, params=None, headers=None):
+    """Like `get_session().get(url, params=params, headers=headers)` but if
+    there's a cached response, with an ETag or Last-Modified, it's
+    revalidated and if the server says 304 the cached response is returned.
+    Responses have a `from_cache` attribute."""
+    url = requests.Request("GET", url, params=params).prepare().url
+    path = _cache_path(url)
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (FileNotFoundError, ValueError):
+        cached = None
+
+    headers = dict(headers or {})
+    if cached:
+        if cached["headers"].get("ETag"):
+            headers["If-None-Match"] = cached["headers"]["ETag"]
+        if cached["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = cached["headers"]["Last-Modified"]
+    response = get_session().get(url, headers=headers)
+    if response.status_code == 304 and cached:
+        return _from_cache(url, cached)
+
+    response.from_cache = False
+    if response.status_code == 200 and (
+        response.headers.get("ETag") or response.headers.get("Last-Modified")
+    ):
+        write_json(
+            path,
+            {
+                "headers": dict(response.headers),
+                "encoding": response.encoding,
+                # Latin-1 maps every byte to a character and back.
+                "content": response.content.decode("latin-1"),
+            },
+        )
+    elif cached:
+        # Whatever it was, it can't be revalidated any more.
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return response
+
+
+def _from_cache(url, cached):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(cached["headers"])
+    response.encoding = cached["encoding"]
+    response._content = cached["content"].encode("latin-1")
+    response.from_cache = True
+    return response
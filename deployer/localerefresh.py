@@ -1,17 +1,26 @@
 import re
+import json
 import os
-import shlex
-import subprocess
+import tempfile
 import datetime
-import sys
 import time
 from pathlib import Path
 
 import click
 import git
 
+from . import pocatalog, resolver
 from .submodules import make_submodules_pr
-from .utils import info, success, warning, humanize_seconds
+from .utils import (
+    checkout_cache_path,
+    fmt_seconds,
+    info,
+    success,
+    warning,
+    humanize_seconds,
+    run_command,
+    write_json,
+)
 from .exceptions import (
     PuenteVersionError,
     DirtyRepoError,
@@ -19,23 +28,17 @@ from .exceptions import (
     SubmoduleFindingError,
 )
 
-
-def run_command(command):
-    process = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE)
-    while True:
-        output = process.stdout.readline()
-        if output == "" and process.poll() is not None:
-            break
-        if output:
-            print(output.strip())
-    rc = process.poll()
-    return rc
-
-
 puente_version_regex = re.compile(r'([\'"]VERSION[\'"]:\s*[\'"]([\d\.]+)[\'"])')
 
+# What `make localerefresh` is busy with, going by the lines it outputs.
+LOCALEREFRESH_PHASES = (
+    ("extract", re.compile(r"manage\.py extract|Extracting")),
+    ("merge", re.compile(r"manage\.py merge|Merging")),
+    ("compile", re.compile(r"compile-mo|compilemessages|compilejsi18n|Compiling")),
+)
+
 
-def start_localerefresh(repo_location, config):
+def start_localerefresh(repo_location, config, force=False):
     repo = git.Repo(repo_location)
 
     if 0:
@@ -91,45 +94,57 @@ def start_localerefresh(repo_location, config):
         raise SubmoduleFindingError(f"Can't find origin 'origin'")
     remote.pull(config["master_branch"])
 
+    # Is there anything new to extract since the last time?
+    manifest = extraction_manifest(repo, "HEAD", locale_repo)
+    previous_manifest = load_manifest(repo_location)
+    if previous_manifest and not force:
+        changed = sorted(
+            path
+            for path in set(manifest) | set(previous_manifest)
+            if manifest.get(path) != previous_manifest.get(path)
+        )
+        if not changed:
+            success(
+                "Nothing that strings are extracted from has changed since the "
+                "last localerefresh. Nothing to do! (use --force to run it anyway)"
+            )
+            return
+        info(f"{len(changed):,} inputs changed since the last localerefresh:")
+        for path in changed[:20]:
+            info(f"\t{path}")
+        if len(changed) > 20:
+            info(f"\t...and {len(changed) - 20:,} more")
+
     cmd = "docker-compose exec web make localerefresh"
 
     filename = "localerefresh.log"
     info(f"Hold my 🍺 whilst I run {cmd!r} (logging in {filename} too)")
-    t0 = time.time()
-
-    with open(filename, "wb") as f:  # replace 'w' with 'wb' for Python 3
-        process = subprocess.Popen(
-            shlex.split(cmd), stdout=subprocess.PIPE, cwd=repo_location
-        )
-        for line in iter(process.stdout.readline, b""):
-            sys.stdout.write(line.decode("utf-8"))
-            f.write(line)
-
-    t1 = time.time()
-
-    seconds = int(t1 - t0)
-    success(
-        f"Sucessfully ran localerefresh. "
-        f"Only took {seconds % 3600 // 60} minutes, {seconds % 60} seconds."
+    ran = run_command(
+        cmd, cwd=repo_location, log_filename=filename, phases=LOCALEREFRESH_PHASES
     )
 
-    new_msgids = set()
-    total_diff_files = 0
-    total_diff_lines = 0
-    for diff in locale_repo.index.diff(None, create_patch=True):
-        total_diff_files += 1
-        for line in diff.diff.splitlines():
-            total_diff_lines += 1
-            if line.startswith(b"+msgid") and line != b'+msgid ""':
-                new_msgids.add(line)
-
-    info(f"{total_diff_files:,} files and {total_diff_lines:,} lines in the diff")
+    took = fmt_seconds(ran["seconds"]).strip()
+    success(f"Sucessfully ran localerefresh. Only took {took}.")
+    for name, seconds in ran["phases"]:
+        info(f"\t{name:<10} {fmt_seconds(seconds)}")
+
+    scanned = scan_diff(locale_repo)
+    info(f"{scanned['files']:,} files and {scanned['lines']:,} lines in the diff")
+
+    after = pocatalog.catalog_index(locale_repo)
+    compared = pocatalog.compare(pocatalog.catalog_index(locale_repo, "HEAD"), after)
+    new_msgids = sorted(pocatalog.format_key(key) for key in compared["added"])
+    info(
+        f"{len(new_msgids):,} new and {len(compared['removed']):,} removed msgids. "
+        f"{compared['fuzzy']:,} fuzzy and {compared['untranslated']:,} "
+        "untranslated entries in total."
+    )
+    show_coverage(after)
 
     if new_msgids:
-        info(f"There are {len(new_msgids)} new '+msgid' strings.")
         if click.confirm("Wanna see a list of these new additions?", default=True):
             for line in new_msgids:
-                info(f"\t{line.decode('utf-8')}")
+                info(f"\t{line}")
     print("")  # Some whitespace
     if not click.confirm(
         "Do you want to proceed and commit this diff?", default=bool(new_msgids)
@@ -139,71 +154,40 @@ def start_localerefresh(repo_location, config):
         info("\tgit submodule foreach git reset --hard")
         return
 
-    # Gather all untracked files
-    all_untracked_files = {}
-    for path in locale_repo.untracked_files:
-        path = os.path.join(locale_repo.working_dir, path)
-        root = path.split(os.path.sep)[0]
-        if root not in all_untracked_files:
-            all_untracked_files[root] = {
-                "files": [],
-                "total_count": count_files_in_directory(root),
-            }
-        all_untracked_files[root]["files"].append(path)
-    # Now filter this based on it being single files or a bunch
-    untracked_files = {}
-    for root, data in all_untracked_files.items():
-        for path in data["files"]:
-            age = time.time() - os.stat(path).st_mtime
-            # If there's fewer untracked files in its directory, suggest
-            # the directory instead.
-            if data["total_count"] == 1:
-                path = root
-            if path in untracked_files:
-                if age < untracked_files[path]:
-                    # youngest file in that directory
-                    untracked_files[path] = age
-            else:
-                untracked_files[path] = age
-
-    if untracked_files:
-        ordered = sorted(untracked_files.items(), key=lambda x: x[1], reverse=True)
+    untracked = scan_untracked(locale_repo)
+    if untracked:
+        now = time.time()
+        ordered = sorted(untracked.items(), key=lambda x: x[1]["mtime"])
         warning("There are untracked files in the locale submodule")
-        for path, age in ordered:
-            if os.path.isdir(path):
-                path = path + "/"
-            print("\t", path.ljust(60), humanize_seconds(age), "old")
+        for path, data in ordered:
+            if path.endswith("/"):
+                files = data["files"]
+                path += f" ({files:,} file{'s' if files != 1 else ''})"
+            print(
+                "\t",
+                path.ljust(60),
+                f"{data['size'] / 1024:,.1f}KB".rjust(12),
+                humanize_seconds(max(1, now - data["mtime"])),
+                "old",
+            )
 
         if not click.confirm("Wanna ignore those?", default=True):
             info("Go ahead and address those untracked files.")
             return
 
     # Now we're going to do the equivalent of `git commit -a -m "..."`
-    index = locale_repo.index
-    files_added = []
-    files_removed = []
-    for x in locale_repo.index.diff(None):
-        if x.deleted_file:
-            files_removed.append(x.b_path)
-        else:
-            files_added.append(x.b_path)
-    files_new = []
-    for x in locale_repo.index.diff(locale_repo.head.commit):
-        files_new.append(x.b_path)
-    if files_added:
-        index.add(files_added)
-        print("ADD", files_added)
-    if files_removed:
-        index.remove(files_removed)
-
-    msg = f"Update strings {next_puente_version}"
-    msg += "\n\n"
-    msg += "New strings are as follows:\n"
-    for line in new_msgids:
-        msg += f"\t{line.decode('utf-8')}\n"
-    # Do it like this (instead of `repo.git.commit(msg)`)
-    # so that git signing works.
-    locale_repo.git.commit(["--no-verify", "-m", msg])
+    files_added = scanned["added"]
+    files_removed = scanned["removed"]
+    stage_paths(locale_repo, files_added + files_removed)
+    info(
+        f"Staged {len(files_added):,} changed and {len(files_removed):,} removed files"
+    )
+
+    msg = "\n".join(
+        [f"Update strings {next_puente_version}", "", "New strings are as follows:"]
+        + [f"\t{line}" for line in new_msgids]
+    )
+    commit_with_message(locale_repo, msg)
     success("Committed 'locale' changes with the following commit message:")
     info(msg)
 
@@ -221,10 +205,10 @@ def start_localerefresh(repo_location, config):
         f.write(new_kuma_settings_content)
         success(f"Editing {settings_file} for {next_puente_version!r}")
 
-    sha = locale_repo.head.object.hexsha
-    short_sha = locale_repo.git.rev_parse(sha, short=7)
+    resolver.invalidate(locale_repo)
+    short_sha = resolver.short_sha(locale_repo)
 
-    make_submodules_pr(
+    created = make_submodules_pr(
         repo_location,
         config,
         accept_dirty=True,
@@ -232,11 +216,156 @@ def start_localerefresh(repo_location, config):
         only_submodules=("locale",),
     )
 
+    # Remember what it was extracted from, as of the branch in the PR.
+    save_manifest(
+        repo_location, extraction_manifest(repo, created["branch"], locale_repo)
+    )
+
+
+# The files that `make localerefresh` extracts strings from.
+EXTRACTION_EXTENSIONS = (".py", ".html", ".js")
+
+
+def extraction_manifest(repo, rev, locale_repo):
+    """Return a dict of path -> blob sha of every file, in `rev` of the Kuma
+    repo, that strings are extracted from. Plus the commit of the locale
+    repo. The blob shas are content hashes that git already has so this is
+    one `git ls-tree`, no matter how many files there are."""
+    manifest = {}
+    for line in repo.git.ls_tree("-r", "-z", rev, "kuma").split("\0"):
+        if not line:
+            continue
+        meta, path = line.split("\t", 1)
+        __, object_type, sha = meta.split()
+        if object_type == "blob" and path.endswith(EXTRACTION_EXTENSIONS):
+            manifest[path] = sha
+    manifest["locale"] = locale_repo.head.commit.hexsha
+    return manifest
+
+
+def _manifest_path(repo_location):
+    return checkout_cache_path("l10n-manifests", repo_location)
+
+
+def load_manifest(repo_location):
+    try:
+        with open(_manifest_path(repo_location)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_manifest(repo_location, manifest):
+    write_json(_manifest_path(repo_location), manifest, indent=1, sort_keys=True)
+
+
+def scan_diff(repo):
+    """Return a dict with the number of "files" and "lines" changed in the
+    working tree diff of the repo and the lists of "added" (or changed) and
+    "removed" paths. It's one `git diff --raw --numstat -z`, which lists
+    every file once with its status and line counts, so there are no patch
+    headers (and no configurable path prefixes) to parse."""
+    scanned = {"files": 0, "lines": 0, "added": [], "removed": []}
+    output = repo.git.diff("--no-ext-diff", "--no-renames", "--raw", "--numstat", "-z")
+    parts = iter(output.split("\0"))
+    for part in parts:
+        if part.startswith(":"):
+            # Like ":100644 000000 {sha} {sha} D" followed by the path.
+            status = part.split()[-1]
+            path = next(parts)
+            scanned["removed" if status == "D" else "added"].append(path)
+            scanned["files"] += 1
+        elif part:
+            # Like "{added}\t{deleted}\t{path}", with "-" for binary files.
+            added, deleted, __ = part.split("\t", 2)
+            if added != "-":
+                scanned["lines"] += int(added) + int(deleted)
+    return scanned
+
+
+def stage_paths(repo, paths):
+    """Stage all these paths (changed, added or removed) in one `git add`.
+    The paths are streamed to git on stdin so there's no limit to how many
+    there can be. They're literal paths, never globs or magic pathspecs."""
+    if not paths:
+        return
+    with tempfile.TemporaryFile() as f:
+        f.write(b"\0".join(path.encode("utf-8") for path in paths))
+        f.seek(0)
+        repo.git.add(
+            "-A",
+            "--pathspec-from-file=-",
+            "--pathspec-file-nul",
+            istream=f,
+            env={"GIT_LITERAL_PATHSPECS": "1"},
+        )
+
+
+def commit_with_message(repo, message):
+    """Commit what's staged. The message is passed to git on stdin, rather
+    than as an argument, so it can be any size."""
+    with tempfile.TemporaryFile() as f:
+        f.write(message.encode("utf-8"))
+        f.seek(0)
+        # Do it like this (instead of `repo.index.commit(msg)`)
+        # so that git signing works.
+        repo.git.commit("--no-verify", "-F", "-", istream=f)
+    resolver.invalidate(repo)
+
+
+def show_coverage(index):
+    """Print how complete every locale's catalogs are in the `index` (see
+    `pocatalog.catalog_index`)."""
+    print(
+        "\t",
+        "LOCALE".ljust(10),
+        "ENTRIES".rjust(8),
+        "DONE".rjust(7),
+        "FUZZY".rjust(7),
+        "MISSING".rjust(8),
+    )
+    for locale, total, translated, fuzzy, untranslated in pocatalog.coverage(index):
+        print(
+            "\t",
+            locale.ljust(10),
+            f"{total:,}".rjust(8),
+            f"{100 * translated / max(1, total):.1f}%".rjust(7),
+            f"{fuzzy:,}".rjust(7),
+            f"{untranslated:,}".rjust(8),
+        )
+
 
-def count_files_in_directory(directory):
-    count = 0
-    for root, _, files in os.walk(directory):
-        # We COULD crosscheck these files against the .gitignore
-        # if we ever felt overachievious.
-        count += len(files)
-    return count
+def scan_untracked(repo):
+    """Return a dict of path -> {"files", "size", "mtime"} of everything
+    untracked in the repo. Like `git status`, a directory that's wholly
+    untracked is one "dir/" entry, with the number of files in it, their
+    total size and the newest mtime.
+
+    It's two `git ls-files` (one of every untracked file and one with the
+    directories collapsed, to group them by) and one `os.lstat()` per
+    untracked file. No tree walks."""
+
+    def others(*args):
+        output = repo.git.ls_files("--others", "--exclude-standard", "-z", *args)
+        return [path for path in output.split("\0") if path]
+
+    untracked = {
+        path: {"files": 0, "size": 0, "mtime": 0}
+        for path in others("--directory", "--no-empty-directory")
+    }
+    for path in others():
+        group = path
+        if group not in untracked:
+            # The wholly untracked directory it's in, e.g. "fr/" for
+            # "fr/LC_MESSAGES/django.po".
+            parts = path.split("/")
+            for i in range(1, len(parts)):
+                group = "/".join(parts[:i]) + "/"
+                if group in untracked:
+                    break
+        stat = os.lstat(os.path.join(repo.working_dir, path))
+        data = untracked[group]
+        data["files"] += 1
+        data["size"] += stat.st_size
+        data["mtime"] = max(data["mtime"], stat.st_mtime)
+    return untracked
@@ -1,12 +1,19 @@
+import datetime
 import functools
 import pkg_resources
 from pathlib import Path
 
 import click
 
+from . import profiler
 from .checker import check_builds
 from .cleaner import start_cleaner
+from .deploy import start_deploy
 from .constants import (
+    PROD_WATCH_URLS,
+    STAGE_WATCH_URLS,
+    DEFAULT_FETCH_DEPTH,
+    DEFAULT_FETCH_FILTER,
     DEFAULT_MASTER_BRANCH,
     DEFAULT_UPSTREAM_NAME,
     DEFAULT_SUBMODULES_UPSTREAM_NAME,
@@ -14,9 +21,11 @@ from .constants import (
 )
 from .exceptions import CoreException
 from .localerefresh import start_localerefresh
+from .partialclone import convert_to_partial_clone
 from .push import prod_push, stage_push
 from .submodules import make_submodules_pr
 from .selfish import self_check
+from .watcher import watch_endpoints
 from .utils import error, info
 
 
@@ -42,6 +51,9 @@ check_builds = cli_wrap(check_builds)
 stage_push = cli_wrap(stage_push)
 prod_push = cli_wrap(prod_push)
 self_check = cli_wrap(self_check)
+start_deploy = cli_wrap(start_deploy)
+convert_to_partial_clone = cli_wrap(convert_to_partial_clone)
+watch_endpoints = cli_wrap(watch_endpoints)
 
 
 @click.group()
@@ -68,6 +80,19 @@ self_check = cli_wrap(self_check)
     default=DEFAULT_YOUR_REMOTE_NAME,
     help=f"Name of your remote (default {DEFAULT_YOUR_REMOTE_NAME!r})",
 )
+@click.option(
+    "--fetch-depth",
+    default=DEFAULT_FETCH_DEPTH,
+    help=(
+        f"only clone this many commits of history into new submodules "
+        f"(default {DEFAULT_FETCH_DEPTH!r} meaning all of it)"
+    ),
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="time every git command, HTTP request, subprocess and prompt",
+)
 @click.option("--debug/--no-debug", default=False)
 @click.argument("kumarepo")
 @click.pass_context
@@ -79,6 +104,8 @@ def cli(
     upstream_name,
     submodules_upstream_name,
     your_remote_name,
+    fetch_depth,
+    profile,
 ):
     ctx.ensure_object(dict)
     ctx.obj["kumarepo"] = kumarepo
@@ -87,6 +114,12 @@ def cli(
     ctx.obj["upstream_name"] = upstream_name
     ctx.obj["submodules_upstream_name"] = submodules_upstream_name
     ctx.obj["your_remote_name"] = your_remote_name
+    ctx.obj["fetch_depth"] = fetch_depth
+
+    if profile:
+        profiler.enable()
+        filename = datetime.datetime.now().strftime("kuma-deployer-%Y%m%d-%H%M%S.json")
+        ctx.call_on_close(lambda: profiler.report(filename))
 
     p = Path(kumarepo)
     if not p.exists():
@@ -110,34 +143,116 @@ def submodules(ctx):
 
 
 @cli.command()
+@click.option(
+    "--filter",
+    "filter_spec",
+    default=DEFAULT_FETCH_FILTER,
+    help=f"partial clone filter (default {DEFAULT_FETCH_FILTER!r})",
+)
+@click.option(
+    "--superproject", is_flag=True, help="the Kuma repo too, not just submodules"
+)
+@click.argument("submodules", nargs=-1)
+@click.pass_context
+def partialclone(ctx, filter_spec, superproject, submodules):
+    """Make the submodules (or just SUBMODULES) fetch blobless from now on."""
+    convert_to_partial_clone(
+        ctx.obj["kumarepo"],
+        ctx.obj,
+        filter_spec,
+        only_submodules=submodules,
+        superproject=superproject,
+    )
+
+
+@cli.command()
+@click.option(
+    "--force", is_flag=True, help="refresh even if no extraction input has changed"
+)
 @click.pass_context
 @cli_wrap
-def l10n(ctx):
-    start_localerefresh(ctx.obj["kumarepo"], ctx.obj)
+def l10n(ctx, force):
+    start_localerefresh(ctx.obj["kumarepo"], ctx.obj, force=force)
 
 
 @cli.command()
+@click.option(
+    "--wait",
+    is_flag=True,
+    help="keep checking until both images are published (skips Jenkins)",
+)
+@click.option(
+    "--timeout",
+    default=30 * 60,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="seconds to --wait before giving up",
+)
 @click.pass_context
-def checkbuilds(ctx):
-    check_builds(ctx.obj["kumarepo"], ctx.obj)
+def checkbuilds(ctx, wait, timeout):
+    check_builds(ctx.obj["kumarepo"], ctx.obj, wait=wait, timeout=timeout)
 
 
 @cli.command()
+@click.option(
+    "--checkout",
+    is_flag=True,
+    help="check out and merge the branches in the working tree (the old way)",
+)
 @click.pass_context
-def stagepush(ctx):
-    stage_push(ctx.obj["kumarepo"], ctx.obj)
+def stagepush(ctx, checkout):
+    stage_push(ctx.obj["kumarepo"], ctx.obj, checkout=checkout)
 
 
 @cli.command()
+@click.option(
+    "--checkout",
+    is_flag=True,
+    help="check out and merge the branches in the working tree (the old way)",
+)
 @click.pass_context
-def prodpush(ctx):
-    prod_push(ctx.obj["kumarepo"], ctx.obj)
+def prodpush(ctx, checkout):
+    prod_push(ctx.obj["kumarepo"], ctx.obj, checkout=checkout)
 
 
 @cli.command()
+@click.option(
+    "--restart", is_flag=True, help="start over instead of resuming the last deploy"
+)
+@click.pass_context
+def deploy(ctx, restart):
+    """Run all the steps, from submodules to prod, resuming where it stopped."""
+    start_deploy(ctx.obj["kumarepo"], ctx.obj, restart=restart)
+
+
+@cli.command()
+@click.option("--stage", is_flag=True, help="watch the stage endpoints, not prod")
+@click.option(
+    "--timeout",
+    default=30 * 60,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="seconds to wait for them all to change before giving up",
+)
+@click.argument("urls", nargs=-1)
+@click.pass_context
+def watch(ctx, stage, timeout, urls):
+    """Watch endpoints (e.g. revision.txt URLs) until they've all changed."""
+    watch_endpoints(
+        list(urls) or (STAGE_WATCH_URLS if stage else PROD_WATCH_URLS),
+        timeout=timeout,
+    )
+
+
+@cli.command()
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="only check local state, without updating submodules or asking GitHub",
+)
 @click.pass_context
-def selfcheck(ctx):
-    self_check(ctx.obj["kumarepo"], ctx.obj)
+def selfcheck(ctx, offline):
+    self_check(ctx.obj["kumarepo"], ctx.obj, offline=offline)
 
 
 @cli.command()
@@ -0,0 +1,60 @@
+import git
+
+from .exceptions import PartialCloneError
+from .utils import info, success, warning
+
+
+def convert_to_partial_clone(
+    repo_location, config, filter_spec, only_submodules=None, superproject=False
+):
+    """Make existing submodule checkouts (and optionally the Kuma repo
+    itself) partial clones. Nothing is downloaded or deleted. From then on,
+    every fetch and pull from the upstream remote uses `filter_spec` (e.g.
+    'blob:none') so only commits and trees are transferred and file contents
+    are fetched when they're actually needed."""
+    repo = git.Repo(repo_location)
+    if repo.git.version_info < (2, 27):
+        raise PartialCloneError(
+            "Partial clones need git 2.27 or newer. "
+            f"You have {'.'.join(str(x) for x in repo.git.version_info)}."
+        )
+
+    repos = []
+    if superproject:
+        repos.append(("kuma", repo, config["upstream_name"]))
+    upstream_name = config.get("submodules_upstream_name") or config["upstream_name"]
+    for submodule in repo.submodules:
+        if only_submodules and submodule.name not in only_submodules:
+            continue
+        repos.append((submodule.name, submodule.module(), upstream_name))
+
+    for name, sub_repo, remote_name in repos:
+        if remote_name not in [remote.name for remote in sub_repo.remotes]:
+            raise PartialCloneError(f"{name!r} has no remote called {remote_name!r}")
+        try:
+            current = sub_repo.git.config("extensions.partialClone")
+        except git.exc.GitCommandError:
+            # Exits with 1 when it's not set.
+            current = None
+        if current and current != remote_name:
+            warning(
+                f"{name!r} is already a partial clone of {current!r}, "
+                f"not {remote_name!r}. Leaving it alone."
+            )
+            continue
+
+        sub_repo.git.config("core.repositoryformatversion", "1")
+        sub_repo.git.config("extensions.partialClone", remote_name)
+        sub_repo.git.config(f"remote.{remote_name}.promisor", "true")
+        sub_repo.git.config(f"remote.{remote_name}.partialclonefilter", filter_spec)
+        success(
+            f"{name!r} now fetches from {remote_name!r} with --filter={filter_spec}"
+        )
+
+    info(
+        "\nObjects that are already downloaded are kept. To also reclaim that "
+        "disk space, re-clone a submodule with something like:\n"
+        "\n\tgit submodule deinit -f locale\n"
+        "\trm -fr .git/modules/locale\n"
+        f"\tgit submodule update --init --filter={filter_spec} locale\n"
+    )
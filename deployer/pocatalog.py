@@ -0,0 +1,200 @@
+import json
+import os
+import tempfile
+
+from .constants import CACHE_DIR
+from .utils import write_json
+
+UNTRANSLATED, TRANSLATED, FUZZY = 0, 1, 2
+
+
+def parse_po(content):
+    """Return a dict of key -> UNTRANSLATED, TRANSLATED or FUZZY for every
+    entry in the PO file `content` (bytes). The key is the msgid (with its
+    msgctxt and msgid_plural, if any) as it's written in the file, with
+    multi-line strings joined. The header and obsolete entries are left
+    out."""
+    entries = {}
+    entry = {}
+    fuzzy = False
+    field = None
+
+    def flush():
+        if entry.get("msgid"):
+            key = entry["msgid"]
+            if "msgctxt" in entry:
+                key = f"{entry['msgctxt']}\x04{key}"
+            if "msgid_plural" in entry:
+                key = f"{key}\x00{entry['msgid_plural']}"
+            msgstrs = [v for k, v in entry.items() if k.startswith("msgstr")]
+            if fuzzy:
+                entries[key] = FUZZY
+            elif msgstrs and all(msgstrs):
+                entries[key] = TRANSLATED
+            else:
+                entries[key] = UNTRANSLATED
+        entry.clear()
+
+    for line in content.decode("utf-8", "replace").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#~"):
+            continue
+        if line.startswith("#"):
+            if field and field.startswith("msgstr"):
+                # A comment after a msgstr starts the next entry.
+                flush()
+                fuzzy = False
+                field = None
+            if line.startswith("#,") and "fuzzy" in line:
+                fuzzy = True
+            continue
+        if line.startswith('"'):
+            if field:
+                entry[field] += line[1:-1]
+            continue
+        keyword, __, value = line.partition(" ")
+        if keyword in ("msgctxt", "msgid") and field and field.startswith("msgstr"):
+            flush()
+            fuzzy = False
+        field = keyword
+        entry[field] = value.strip()[1:-1]
+    flush()
+    return entries
+
+
+def _cache_path(sha):
+    return os.path.join(CACHE_DIR, "po", sha[:2], f"{sha}.json")
+
+
+def _parse_cached(sha, read):
+    """Return the parsed entries of the blob `sha`, only calling `read()` to
+    get the content (and parsing it) if it's not in the cache already. Blobs
+    never change so the cache never needs to be invalidated."""
+    path = _cache_path(sha)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    entries = parse_po(read())
+    write_json(path, entries)
+    return entries
+
+
+def catalog_index(repo, rev=None):
+    """Return a dict of .po path -> entries (see `parse_po`) for all the
+    catalogs in the `rev` (e.g. 'HEAD') of the repo or, if `rev` is None, in
+    the working tree.
+
+    Every catalog is identified by its blob sha. Working tree files only get
+    hashed if git thinks they've changed. Untracked catalogs are left out,
+    like they are from what gets committed."""
+    shas = {}
+    if rev:
+        for line in repo.git.ls_tree("-r", "-z", rev).split("\0"):
+            if line.endswith(".po"):
+                meta, path = line.split("\t", 1)
+                shas[path] = meta.split()[2]
+    else:
+        for line in repo.git.ls_files("-s", "-z", "--", "*.po").split("\0"):
+            if line:
+                meta, path = line.split("\t", 1)
+                shas[path] = meta.split()[1]
+        for path in repo.git.ls_files("--deleted", "-z", "--", "*.po").split("\0"):
+            shas.pop(path, None)
+        # Modified, but not deleted, in the working tree.
+        changed = [
+            path
+            for path in repo.git.diff(
+                "--name-only", "--diff-filter=d", "-z", "--", "*.po"
+            ).split("\0")
+            if path
+        ]
+        if changed:
+            # On stdin, so there's no limit to how many there can be.
+            with tempfile.TemporaryFile() as f:
+                f.write("\n".join(changed).encode("utf-8"))
+                f.seek(0)
+                hashed = repo.git.hash_object("--stdin-paths", istream=f).split()
+            shas.update(zip(changed, hashed))
+
+    index = {}
+    for path, sha in shas.items():
+        if rev:
+
+            def read(sha=sha):
+                return repo.git.get_object_data(sha)[3]
+
+        else:
+
+            def read(path=path):
+                with open(os.path.join(repo.working_dir, path), "rb") as f:
+                    return f.read()
+
+        index[path] = _parse_cached(sha, read)
+    return index
+
+
+def _by_locale(index):
+    locales = {}
+    for path, entries in index.items():
+        # E.g. 'fr/LC_MESSAGES/django.po'
+        locale = path.split("/")[0]
+        locales.setdefault(locale, {}).update(
+            {f"{path}\x01{key}": state for key, state in entries.items()}
+        )
+    return locales
+
+
+def coverage(index):
+    """Return a list of (locale, total, translated, fuzzy, untranslated),
+    sorted by locale."""
+    table = []
+    for locale, entries in sorted(_by_locale(index).items()):
+        states = list(entries.values())
+        table.append(
+            (
+                locale,
+                len(states),
+                states.count(TRANSLATED),
+                states.count(FUZZY),
+                states.count(UNTRANSLATED),
+            )
+        )
+    return table
+
+
+def compare(before, after):
+    """Return a dict with the sets of "added" and "removed" msgids (across
+    all catalogs) and how many entries are "fuzzy" and "untranslated" in
+    `after`."""
+    before_keys = set()
+    for entries in before.values():
+        before_keys.update(entries)
+    after_keys = set()
+    fuzzy = untranslated = 0
+    for entries in after.values():
+        after_keys.update(entries)
+        for state in entries.values():
+            if state == FUZZY:
+                fuzzy += 1
+            elif state == UNTRANSLATED:
+                untranslated += 1
+    return {
+        "added": after_keys - before_keys,
+        "removed": before_keys - after_keys,
+        "fuzzy": fuzzy,
+        "untranslated": untranslated,
+    }
+
+
+def format_key(key):
+    """Return the key the way it'd look in a PO file."""
+    msgctxt, __, msgid = key.rpartition("\x04")
+    msgid, __, plural = msgid.partition("\x00")
+    formatted = f'msgid "{msgid}"'
+    if msgctxt:
+        formatted = f'msgctxt "{msgctxt}" {formatted}'
+    if plural:
+        formatted += f' msgid_plural "{plural}"'
+    return formatted
@@ -0,0 +1,166 @@
+import builtins
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import click
+import git
+import requests
+
+# When profiling is enabled, every git command, HTTP request, subprocess
+# and prompt is recorded as a span. They're written out as a Chrome trace
+# (open it in chrome://tracing or https://ui.perfetto.dev) and summarized.
+_lock = threading.Lock()
+_spans = []
+_enabled = False
+_t0 = None
+
+
+@contextlib.contextmanager
+def span(category, name, **args):
+    """Record how long the block takes, if profiling is enabled."""
+    if not _enabled:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        duration = time.perf_counter() - start
+        with _lock:
+            _spans.append(
+                {
+                    "cat": category,
+                    "name": name,
+                    "start": start,
+                    "duration": duration,
+                    "tid": threading.get_native_id(),
+                    "args": args,
+                }
+            )
+
+
+def _wrap(owner, attribute, make_span):
+    original = getattr(owner, attribute)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        category, name, span_args = make_span(*args, **kwargs)
+        with span(category, name, **span_args):
+            return original(*args, **kwargs)
+
+    setattr(owner, attribute, wrapper)
+
+
+def _git_span(self, command, *args, **kwargs):
+    if isinstance(command, str):
+        command = command.split()
+    # Skip past the options (like `-c key=value`) to the git subcommand.
+    words = iter(command[1:])
+    subcommand = ""
+    for word in words:
+        if word == "-c":
+            next(words, None)
+        elif not word.startswith("-"):
+            subcommand = word
+            break
+    span_args = {
+        "repo": os.path.basename(self.working_dir or ""),
+        "command": " ".join(str(x) for x in command),
+    }
+    if kwargs.get("as_process"):
+        # Only the time to start it. The output is read afterwards.
+        span_args["as_process"] = True
+    return "git", f"git {subcommand}", span_args
+
+
+def _cat_file_span(self, ref):
+    args = {"repo": os.path.basename(self.working_dir or ""), "ref": str(ref)}
+    return "git", "git cat-file (persistent)", args
+
+
+def _http_span(self, method, url, *args, **kwargs):
+    return "http", f"{method.upper()} {urlparse(url).netloc}", {"url": url}
+
+
+def _prompt_span(text="", *args, **kwargs):
+    return "prompt", "prompt", {"text": str(text)}
+
+
+def enable():
+    """Start recording spans."""
+    global _enabled, _t0
+    if _enabled:
+        return
+    _enabled = True
+    _t0 = time.perf_counter()
+    _wrap(git.cmd.Git, "execute", _git_span)
+    _wrap(git.cmd.Git, "get_object_header", _cat_file_span)
+    _wrap(git.cmd.Git, "get_object_data", _cat_file_span)
+    _wrap(requests.Session, "request", _http_span)
+    _wrap(click, "confirm", _prompt_span)
+    _wrap(click, "prompt", _prompt_span)
+    _wrap(builtins, "input", _prompt_span)
+
+
+def write_trace(filename):
+    """Write the spans as Chrome trace events."""
+    pid = os.getpid()
+    with _lock:
+        events = [
+            {
+                "name": s["name"],
+                "cat": s["cat"],
+                "ph": "X",
+                "ts": (s["start"] - _t0) * 1e6,
+                "dur": s["duration"] * 1e6,
+                "pid": pid,
+                "tid": s["tid"],
+                "args": s["args"],
+            }
+            for s in _spans
+        ]
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def summarize(top=15):
+    """Return (wall seconds, prompt seconds, rows) where the rows are the
+    `top` (category, name, count, total seconds, max seconds) by total."""
+    groups = {}
+    prompt_seconds = 0.0
+    with _lock:
+        for s in _spans:
+            if s["cat"] == "prompt":
+                prompt_seconds += s["duration"]
+            group = groups.setdefault((s["cat"], s["name"]), [0, 0.0, 0.0])
+            group[0] += 1
+            group[1] += s["duration"]
+            group[2] = max(group[2], s["duration"])
+    rows = sorted(
+        ((cat, name, *numbers) for (cat, name), numbers in groups.items()),
+        key=lambda row: row[3],
+        reverse=True,
+    )
+    return time.perf_counter() - _t0, prompt_seconds, rows[:top]
+
+
+def report(filename, top=15):
+    """Write the trace file and print the summary."""
+    write_trace(filename)
+    wall, prompt_seconds, rows = summarize(top=top)
+    click.echo("")
+    click.echo(
+        f"Took {wall:.2f}s: {wall - prompt_seconds:.2f}s working and "
+        f"{prompt_seconds:.2f}s waiting for you to answer prompts."
+    )
+    click.echo(f"{'':<8} {'':<40} {'COUNT':>6} {'TOTAL':>9} {'MAX':>9}")
+    for category, name, count, total, longest in rows:
+        click.echo(
+            f"{category:<8} {name[:40]:<40} {count:>6} {total:>8.3f}s {longest:>8.3f}s"
+        )
+    click.echo(f"Trace written to {filename} (open it in https://ui.perfetto.dev)")
@@ -1,23 +1,34 @@
 import shutil
-import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 import click
 import git
 
+from . import resolver
 from .constants import (
     PROD_PUSH_BRANCH,
+    PROD_WATCH_URLS,
     STAGE_INTEGRATIONTEST_BRANCH,
     STAGE_PUSH_BRANCH,
+    STAGE_WATCH_URLS,
     STANDBY_PUSH_BRANCH,
+    WHATSDEPLOYED_URL,
 )
 from .exceptions import (
     DirtyRepoError,
     PushBranchError,
+    PushError,
     RemoteURLError,
     MasterBranchError,
 )
-from .utils import info, success, warning, requests_retry_session
+from .utils import error, info, success, warning
+from .watcher import watch_endpoints
+
+WHATSDEPLOYED_URLS = {
+    "Kuma": WHATSDEPLOYED_URL,
+    "Kumascript": "https://whatsdeployed.io/s/SWJ/mdn/kumascript",
+}
 
 
 def center(msg):
@@ -25,13 +36,10 @@ def center(msg):
     warning(f"-----  {msg}  ".ljust(t_width, "-"))
 
 
-def stage_push(repo_location, config):
-    center(f"STAGE {STAGE_PUSH_BRANCH!r}")
-    push(repo_location, config, STAGE_PUSH_BRANCH)
-
-    print("\n")  # some deliberate whitespace
-    center(f"STAGE {STAGE_INTEGRATIONTEST_BRANCH!r}")
-    push(repo_location, config, STAGE_INTEGRATIONTEST_BRANCH, show_whatsdeployed=False)
+def stage_push(repo_location, config, checkout=False, watch=True):
+    branches = [STAGE_PUSH_BRANCH, STAGE_INTEGRATIONTEST_BRANCH]
+    center(f"STAGE {', '.join(repr(x) for x in branches)}")
+    pushed = push(repo_location, config, branches, checkout=checkout)
     info(
         "\nNow sit back and hold out for some sweat success of the integration tests. "
         "Check out #mdn-infra, on Slack, to for the joyous announcements. \n"
@@ -42,13 +50,16 @@ def stage_push(repo_location, config):
         "https://ci.us-west-2.mdn.mozit.cloud/blue/organizations/jenkins/kuma/branches/"
     )
 
-    print("\n")  # deliberate whitespace
-    start_watching_for_change("https://developer.allizom.org/media/revision.txt")
+    if watch:
+        print("\n")  # deliberate whitespace
+        watch_pushed(STAGE_WATCH_URLS, pushed)
+    return pushed
 
 
-def prod_push(repo_location, config):
-    center(f"PROD {PROD_PUSH_BRANCH!r}")
-    push(repo_location, config, PROD_PUSH_BRANCH)
+def prod_push(repo_location, config, checkout=False, watch=True):
+    branches = [PROD_PUSH_BRANCH, STANDBY_PUSH_BRANCH]
+    center(f"PROD {', '.join(repr(x) for x in branches)}")
+    pushed = push(repo_location, config, branches, checkout=checkout)
 
     info(
         "\nAfter Whatsdeploy says it's up, go troll and lurk on:\n\t"
@@ -56,15 +67,45 @@ def prod_push(repo_location, config):
         "72968468/traced_errors\n"
     )
 
-    print("\n")  # some deliberate whitespace
-    center(f"PROD {STANDBY_PUSH_BRANCH!r}")
-    push(repo_location, config, STANDBY_PUSH_BRANCH)
-
-    print("\n")  # deliberate whitespace
-    start_watching_for_change("https://developer.mozilla.org/media/revision.txt")
-
-
-def push(repo_location, config, branch, show_whatsdeployed=True, show_jenkins=True):
+    if watch:
+        print("\n")  # deliberate whitespace
+        watch_pushed(PROD_WATCH_URLS, pushed)
+    return pushed
+
+
+def watch_pushed(urls, pushed):
+    """Watch the endpoints of the repos (of "Kuma" and "Kumascript") in
+    `pushed`. A repo that had nothing new pushed won't be redeployed, so its
+    endpoint would never change. Kumascript's endpoints are the ones with
+    "kumascript" in the URL (e.g. kumascript-revision.txt). If `pushed` is
+    None (not known), all the endpoints are watched."""
+    if pushed is not None:
+        urls = [
+            url
+            for url in urls
+            if ("Kumascript" if "kumascript" in url.lower() else "Kuma") in pushed
+        ]
+    if not urls:
+        info("Nothing new was pushed so there's nothing to watch.")
+        return {}
+    return watch_endpoints(urls)
+
+
+def push(
+    repo_location,
+    config,
+    branches,
+    show_whatsdeployed=True,
+    show_jenkins=True,
+    checkout=False,
+):
+    """Update and push all the `branches` (e.g. ['prod-push', 'standby-push'])
+    in both Kuma and Kumascript. Each repo is fetched once and all its
+    branches go out in one atomic push so they're updated together.
+
+    Unless `checkout` is true, the branches are updated without touching the
+    working tree or the index. Returns the list of the repos ("Kuma" and/or
+    "Kumascript") that had anything new pushed."""
     repo = git.Repo(repo_location)
     # Check if it's dirty
     if repo.is_dirty():
@@ -74,6 +115,7 @@ def push(repo_location, config, branch, show_whatsdeployed=True, show_jenkins=Tr
         )
 
     # Are you on the "master" branch?
+    fetched = False
     active_branch = repo.active_branch
     if active_branch.name == config["master_branch"]:
         # Need to check that it's up to date.
@@ -81,17 +123,32 @@ def push(repo_location, config, branch, show_whatsdeployed=True, show_jenkins=Tr
         upstream_remote = repo.remotes[config["upstream_name"]]
         info(f"Fetching all branches from {config['upstream_name']}")
         upstream_remote.fetch()
+        resolver.invalidate(repo)
+        fetched = True
         remote_master_branch = f"{config['upstream_name']}/{config['master_branch']}"
-        diff = repo.git.diff(remote_master_branch)
-        if diff:
+        ahead, behind = ahead_behind(repo, "HEAD", remote_master_branch)
+        if ahead:
             warning(
-                f"Your local {config['master_branch']} is different from "
-                f"{remote_master_branch!r}."
+                f"Your local {config['master_branch']} is {ahead} "
+                f"commit{'s' if ahead > 1 else ''} ahead of {remote_master_branch!r}."
             )
+        if behind:
+            warning(
+                f"Your local {config['master_branch']} is {behind} "
+                f"commit{'s' if behind > 1 else ''} behind {remote_master_branch!r}. "
+                "Pulling would bring in:"
+            )
+            for line in repo.git.log(
+                "--oneline", "-n", "10", f"HEAD..{remote_master_branch}"
+            ).splitlines():
+                info(f"\t{line}")
+            if behind > 10:
+                info(f"\t...and {behind - 10} more")
             if click.confirm(
                 f"Want to pull latest {remote_master_branch!r}", default=True
             ):
                 upstream_remote.pull(config["master_branch"])
+                resolver.invalidate(repo)
                 info(
                     f"Pulled latest {config['master_branch']} from "
                     f"{config['upstream_name']}."
@@ -109,28 +166,11 @@ def push(repo_location, config, branch, show_whatsdeployed=True, show_jenkins=Tr
                 f"Bailing because not in {config['master_branch']!r}"
             )
 
-    # Kuma
-    short_sha = _push_repo(repo, config, branch)
-    success(
-        f"Kuma: " f"Latest {branch!r} branch pushed to {config['upstream_name']!r}\n"
-    )
-    if show_jenkins:
-        sha = repo.head.object.hexsha
-        short_sha = repo.git.rev_parse(sha, short=7)
-        jenkins_url = (
-            f"https://ci.us-west-2.mdn.mozit.cloud/blue/organizations/jenkins/"
-            f"kuma/activity?branch={branch}"
-        )
-        info(f"Now, look for {short_sha} in\n\t{jenkins_url}")
-    if show_whatsdeployed:
-        info("Keep an eye on\n\thttps://whatsdeployed.io/s/HC0/mozilla/kuma")
-
-    print("\n")  # Some whitespace before Kumascript
-
     # Kumascript
     ks_repo = repo.submodules["kumascript"].module()
     # just in case it was detached
     ks_repo.heads[config["master_branch"]].checkout()
+    resolver.invalidate(ks_repo)
     ks_remote = ks_repo.remotes[config["upstream_name"]]
     for url in ks_remote.urls:
         if "git://" in url:
@@ -141,83 +181,199 @@ def push(repo_location, config, branch, show_whatsdeployed=True, show_jenkins=Tr
                 f"\n\tcd kumascript\n"
                 f"\tgit remote set-url {config['upstream_name']} {better_url}\n"
             )
-    short_sha = _push_repo(ks_repo, config, branch)
-    success(
-        f"Kumascript: "
-        f"Latest {branch!r} branch pushed to {config['upstream_name']!r}"
-    )
-    if show_jenkins:
-        jenkins_url = (
-            f"https://ci.us-west-2.mdn.mozit.cloud/blue/organizations/jenkins/"
-            f"kumascript/activity?branch={branch}"
+
+    # The two are separate repos with separate remotes so push both at the
+    # same time. Everything that can be checked up front has been, so if
+    # one of them fails, the other one is still allowed to finish.
+    # Kuma was just fetched above, if it's on master.
+    pushing = ", ".join(repr(x) for x in branches)
+    info(f"Pushing {pushing} for Kuma and Kumascript")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {
+            "Kuma": executor.submit(
+                _push_repo, repo, config, branches, not fetched, checkout
+            ),
+            "Kumascript": executor.submit(
+                _push_repo, ks_repo, config, branches, True, checkout
+            ),
+        }
+    failures = {}
+    pushed = []
+    for name, future in futures.items():
+        try:
+            short_shas, moved = future.result()
+        except Exception as exception:
+            error(f"{name}: Failed to push {pushing} to {config['upstream_name']!r}")
+            error(exception)
+            failures[name] = exception
+            continue
+        if moved:
+            pushed.append(name)
+        success(
+            f"{name}: "
+            f"Latest {pushing} branch{'es' if len(branches) > 1 else ''} pushed to "
+            f"{config['upstream_name']!r}"
         )
-        info(f"Now, look for {short_sha} in\n\t{jenkins_url}")
-    if show_whatsdeployed:
-        info("Keep an eye on\n\thttps://whatsdeployed.io/s/SWJ/mdn/kumascript")
+        if show_jenkins:
+            for branch, short_sha in short_shas.items():
+                jenkins_url = (
+                    f"https://ci.us-west-2.mdn.mozit.cloud/blue/organizations/jenkins/"
+                    f"{name.lower()}/activity?branch={branch}"
+                )
+                info(f"Now, look for {short_sha} in\n\t{jenkins_url}")
+        if show_whatsdeployed:
+            info(f"Keep an eye on\n\t{WHATSDEPLOYED_URLS[name]}")
+        print("\n")  # Some whitespace between the two
+
+    if failures:
+        raise PushError(
+            f"Pushing {pushing} failed for {' and '.join(failures)}. "
+            "See the output above."
+        )
+    return pushed
+
+
+def ahead_behind(repo, ref, other_ref):
+    """Return (ahead, behind), as in how many commits `ref` has that
+    `other_ref` doesn't and vice versa. Unlike a diff, this costs the same
+    no matter how much the commits changed."""
+    if resolver.resolve(repo, ref) == resolver.resolve(repo, other_ref):
+        return 0, 0
+    counts = repo.git.rev_list("--left-right", "--count", f"{ref}...{other_ref}")
+    ahead, behind = counts.split()
+    return int(ahead), int(behind)
 
 
-def _push_repo(repo, config, branch_name):
+def _push_repo(repo, config, branch_names, fetch=True, checkout=False):
+    """Merge the upstream master into each of the `branch_names` and push them
+    all in one go. Returns a dict of branch name -> short sha and the list of
+    the branches that the push moved."""
     upstream_remote = repo.remotes[config["upstream_name"]]
-    upstream_remote.fetch()
+    if fetch:
+        upstream_remote.fetch()
+        resolver.invalidate(repo)
+
+    # All the branches are computed from the same snapshot of upstream master.
+    origin_master_branch = f"{config['upstream_name']}/{config['master_branch']}"
+    if checkout:
+        short_shas = _merge_with_checkout(repo, config, branch_names)
+    else:
+        short_shas = {}
+        for branch_name in branch_names:
+            sha = _merge_without_checkout(repo, branch_name, origin_master_branch)
+            short_shas[branch_name] = resolver.short_sha(repo, sha)
+
+    moved = [
+        branch_name
+        for branch_name in branch_names
+        if _remote_sha(repo, f"{config['upstream_name']}/{branch_name}")
+        != resolver.resolve(repo, branch_name)
+    ]
+    # Either all the branches are updated, or none of them are.
+    repo.git.push("--atomic", config["upstream_name"], *branch_names)
+    resolver.invalidate(repo)
+
+    return short_shas, moved
 
-    active_branch = repo.active_branch
-    if active_branch.name != branch_name:
-        if branch_name not in [head.name for head in repo.heads]:
-            stage_branch = repo.create_head(branch_name)
-
-        else:
-            for head in repo.heads:
-                if head.name == branch_name:
-                    stage_branch = head
-                    break
-            else:
-                raise PushBranchError(f"Can't check out branch {branch_name!r}")
 
-        stage_branch.checkout()
+def _remote_sha(repo, remote_branch):
+    try:
+        return resolver.resolve(repo, remote_branch)
+    except ValueError:
+        # The branch isn't on the remote yet.
+        return None
 
-    # Merge the origin master branch into this
+
+def _merge_with_checkout(repo, config, branch_names):
     origin_master_branch = f"{config['upstream_name']}/{config['master_branch']}"
-    repo.git.merge(origin_master_branch)
-    sha = repo.head.object.hexsha
-    short_sha = repo.git.rev_parse(sha, short=7)
-    repo.git.push(config["upstream_name"], branch_name)
-
-    # Back to master branch
-    repo.heads[config["master_branch"]].checkout()
-
-    return short_sha
-
-
-def start_watching_for_change(url, sleep_seconds=10):
-    session = requests_retry_session()
-    response = session.get(url)
-    response.raise_for_status()
-
-    def fmt_seconds(delta):
-        seconds = int(delta)
-        if seconds > 60:
-            minutes = seconds // 60
-            seconds = seconds % 60
-            return (
-                f"{minutes} minute{'s' if minutes > 1 else ''} "
-                f"{seconds} second{'s' if seconds > 1 else ''} "
+    short_shas = {}
+    try:
+        for branch_name in branch_names:
+            if repo.active_branch.name != branch_name:
+                if branch_name not in [head.name for head in repo.heads]:
+                    stage_branch = repo.create_head(branch_name)
+
+                else:
+                    for head in repo.heads:
+                        if head.name == branch_name:
+                            stage_branch = head
+                            break
+                    else:
+                        raise PushBranchError(f"Can't check out branch {branch_name!r}")
+
+                stage_branch.checkout()
+
+            # Merge the origin master branch into this
+            try:
+                repo.git.merge(origin_master_branch)
+            except git.exc.GitCommandError:
+                # Don't leave it mid-merge.
+                repo.git.merge(abort=True)
+                raise
+            resolver.invalidate(repo)
+            short_shas[branch_name] = resolver.short_sha(repo)
+    finally:
+        # Back to master branch (even if it failed)
+        repo.heads[config["master_branch"]].checkout()
+        resolver.invalidate(repo)
+
+    return short_shas
+
+
+def _merge_without_checkout(repo, branch_name, origin_master_branch):
+    """Does what checking out `branch_name` and running
+    `git merge {origin_master_branch}` would do, but only with git objects
+    and refs. Returns the new sha of the branch."""
+    if repo.active_branch.name == branch_name:
+        raise PushBranchError(
+            f"Can't update {branch_name!r} without touching the working tree "
+            "because it's the checked out branch. Use --checkout."
+        )
+    target = resolver.resolve(repo, origin_master_branch)
+    exists = branch_name in [head.name for head in repo.heads]
+    if exists:
+        old = repo.heads[branch_name].commit.hexsha
+    else:
+        # Just like `create_head()`, a new branch starts from HEAD.
+        old = repo.head.commit.hexsha
+
+    if old == target or repo.is_ancestor(target, old):
+        # Already up to date
+        new = old
+    elif repo.is_ancestor(old, target):
+        # Fast-forward
+        new = target
+    else:
+        if repo.git.version_info < (2, 38):
+            raise PushBranchError(
+                f"Merging {origin_master_branch!r} into {branch_name!r} needs "
+                "'git merge-tree --write-tree' (git 2.38 or newer). Use --checkout."
             )
-        return f"{seconds} second{'s' if seconds > 1 else ''} "
-
-    t0 = time.time()
-    first_content = response.text
-    info(f"Watching for changes to output from {url}")
-    print(f"(checking every {sleep_seconds} seconds)")
-    while True:
-        time.sleep(10)
-
-        response = session.get(url)
-        response.raise_for_status()
-        new_content = response.text
-        if new_content != first_content:
-            success(f"Output from {url} has changed!\n")
-            info(f"from {first_content!r} to {new_content!r}")
-            info("Stopping the watcher. Bye!")
-            break
-        else:
-            print(f"Been checking for {fmt_seconds(time.time() - t0)}")
+        try:
+            tree = repo.git.merge_tree("--write-tree", old, target).splitlines()[0]
+        except git.exc.GitCommandError:
+            raise PushBranchError(
+                f"Merging {origin_master_branch!r} into {branch_name!r} conflicts."
+            )
+        new = repo.git.commit_tree(
+            tree,
+            "-p",
+            old,
+            "-p",
+            target,
+            "-m",
+            f"Merge remote-tracking branch {origin_master_branch!r} "
+            f"into {branch_name}",
+        )
+
+    # Only move the ref if nobody else did in the meantime. If the branch is
+    # new, the all zeros "old value" means it must not exist yet, so one
+    # that somebody else created in the meantime isn't overwritten.
+    repo.git.update_ref(
+        f"refs/heads/{branch_name}",
+        new,
+        old if exists else "0" * len(new),
+        m=f"kuma-deployer: merge {origin_master_branch}",
+    )
+    resolver.invalidate(repo)
+    return new
@@ -0,0 +1,68 @@
+import threading
+
+# Rather than forking a `git rev-parse` every time, refs, HEADs and short
+# shas are resolved through the one long-lived `git cat-file --batch-check`
+# process GitPython keeps per repo. The answers are memoized (for all repo
+# objects of the same git dir) until `invalidate()` is called, which has to
+# be done whenever we move a ref (pull, merge, commit, checkout, ...).
+# `_lock` only guards these dicts. Asking git is done holding the repo's own
+# lock, because its cat-file process is one pipe that can't be shared by
+# threads, but other repos can be asked at the same time.
+_lock = threading.Lock()
+_cache = {}
+_repo_locks = {}
+# git dir -> how many times it's been invalidated. An answer is only
+# memoized if there was no `invalidate()` while git was being asked.
+_generations = {}
+
+
+def _ask(repo, key, fn):
+    with _lock:
+        if key in _cache:
+            return _cache[key]
+        generation = _generations.get(repo.git_dir, 0)
+        repo_lock = _repo_locks.setdefault(repo.git_dir, threading.Lock())
+    with repo_lock:
+        value = fn()
+    with _lock:
+        if _generations.get(repo.git_dir, 0) == generation:
+            _cache[key] = value
+    return value
+
+
+def resolve(repo, rev):
+    """Return the full commit sha for `rev` (e.g. 'HEAD', 'origin/master')."""
+
+    def ask():
+        return repo.git.get_object_header(f"{rev}^{{commit}}")[0].decode("ascii")
+
+    return _ask(repo, (repo.git_dir, "resolve", rev), ask)
+
+
+def short_sha(repo, rev="HEAD", length=7):
+    """Return the shortest (but at least `length`) unambiguous abbreviation
+    of `rev`, just like `git rev-parse --short={length}` would."""
+    sha = resolve(repo, rev)
+
+    def ask():
+        for size in range(length, len(sha)):
+            try:
+                found = repo.git.get_object_header(sha[:size])[0].decode("ascii")
+            except ValueError:
+                # Ambiguous, so try a longer one.
+                continue
+            if found == sha:
+                break
+        return sha[:size]
+
+    return _ask(repo, (repo.git_dir, "short", sha, length), ask)
+
+
+def invalidate(repo):
+    """Forget everything about this repo. Call this after moving any ref.
+    The cat-file process itself sees ref updates as they happen, so it's
+    only the memo that needs clearing."""
+    with _lock:
+        _generations[repo.git_dir] = _generations.get(repo.git_dir, 0) + 1
+        for key in [key for key in _cache if key[0] == repo.git_dir]:
+            del _cache[key]
@@ -1,15 +1,17 @@
 import re
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import git
-from github import Github
 
-from .constants import GITHUB_ACCESS_TOKEN, KUMA_REPO_NAME
+from .constants import KUMA_REPO_NAME
 from .exceptions import DirtyRepoError
-from .utils import success, warning, info
+from .httpcache import get_github
+from .utils import clone_kwargs, success, warning, info
 
 
-def self_check(repo_location, config):
+def self_check(repo_location, config, offline=False):
     def pp_location(p):
         """return the location if displayed using the ~ notation
         for the user's home directory."""
@@ -24,44 +26,93 @@ def self_check(repo_location, config):
     print()  # whitespace
 
     repo = git.Repo(repo_location)
+    submodules = list(repo.submodules)
 
-    expect_remote_names = [config["upstream_name"], config["your_remote_name"]]
-    for remote in repo.remotes:
-        if remote.name in expect_remote_names:
-            success(f"{pp_location(repo_location)} has a remote called {remote.name}")
-            expect_remote_names.remove(remote.name)
-
-    for name in expect_remote_names:
-        warning(f"Warning! Couldn't find a remote named {name!r}")
-
-    print()  # whitespace
-
+    # Before anything updates the submodules, which moves their HEADs and
+    # would make the superproject look dirty (or not) depending on timing.
     if repo.is_dirty():
         raise DirtyRepoError(
             'The repo is currently "dirty". Stash or commit away.\n'
-            f"Run `git status` inside {pp_location(repo_location)} to see what's up."
+            f"Run `git status` inside {pp_location(repo_location)} to see "
+            "what's up."
         )
-    success(f"Repo at {pp_location(repo_location)} is not dirty.")
-    print()  # whitespace
 
-    for submodule in repo.submodules:
-        submodule.update(init=True)
-        sub_repo = submodule.module()
-        if sub_repo.is_dirty():
-            raise DirtyRepoError(f"The git submodule {submodule!r} is dirty.")
-        success(f"Git submodule {submodule.name!r} is not dirty.")
-
-        # Check that it has remote named {submodules_upstream_name}
-        for remote in sub_repo.remotes:
-            if remote.name == config["submodules_upstream_name"]:
-                break
+    # The GitHub check and the submodules' checks are all independent of
+    # each other so they run while we check the superproject's remotes.
+    with ThreadPoolExecutor(max_workers=len(submodules) + 1) as executor:
+        open_pr_future = None if offline else executor.submit(_find_open_pr)
+        init_lock = threading.Lock()
+        submodule_futures = [
+            executor.submit(_check_submodule, submodule, config, offline, init_lock)
+            for submodule in submodules
+        ]
+
+        expect_remote_names = [config["upstream_name"], config["your_remote_name"]]
+        for remote in repo.remotes:
+            if remote.name in expect_remote_names:
+                success(
+                    f"{pp_location(repo_location)} has a remote called {remote.name}"
+                )
+                expect_remote_names.remove(remote.name)
+
+        for name in expect_remote_names:
+            warning(f"Warning! Couldn't find a remote named {name!r}")
+
+        print()  # whitespace
+
+        success(f"Repo at {pp_location(repo_location)} is not dirty.")
+        print()  # whitespace
+
+        for submodule, future in zip(submodules, submodule_futures):
+            problem = future.result()
+            if problem:
+                warning(problem)
+            else:
+                success(f"Git submodule {submodule.name!r} is not dirty.")
+
+        if offline:
+            info("Offline, so not checking for open pull requests on GitHub.")
         else:
-            warning(
-                f"The git submodule {submodule.name!r} does not have a remote "
-                f"called {config['submodules_upstream_name']!r}!"
-            )
+            pr = open_pr_future.result()
+            if pr:
+                warning(
+                    f"Appears to have open pull request to update submodules! {pr.url}"
+                )
 
-    g = Github(GITHUB_ACCESS_TOKEN)
+    # XXX What else can we check? What about having access to Jenkins?
+
+
+def _check_submodule(submodule, config, offline, init_lock):
+    """Raise DirtyRepoError if the submodule is dirty. Otherwise return what
+    (if anything) is wrong with it."""
+    if offline:
+        # Don't change anything or touch the network. Just look.
+        if not submodule.module_exists():
+            return f"The git submodule {submodule.name!r} isn't initialized!"
+    elif submodule.module_exists():
+        submodule.update(init=True)
+    else:
+        # Initializing writes to the superproject's config.
+        with init_lock:
+            submodule.update(init=True, **clone_kwargs(config))
+    sub_repo = submodule.module()
+    if sub_repo.is_dirty():
+        raise DirtyRepoError(f"The git submodule {submodule!r} is dirty.")
+
+    # Check that it has remote named {submodules_upstream_name}
+    for remote in sub_repo.remotes:
+        if remote.name == config["submodules_upstream_name"]:
+            break
+    else:
+        return (
+            f"The git submodule {submodule.name!r} does not have a remote "
+            f"called {config['submodules_upstream_name']!r}!"
+        )
+
+
+def _find_open_pr():
+    """Return the open pull request that updates the submodules, if any."""
+    g = get_github()
     g_repo = g.get_repo(KUMA_REPO_NAME)
     pulls = g_repo.get_pulls(
         sort="created", direction="desc", state="open", base="master"
@@ -72,7 +123,4 @@ def self_check(repo_location, config):
             and re.findall(r"[a-f0-9]{7}\.\.\.[a-f0-9]{7}", pr.title)
             and pr.state != "closed"
         ):
-            warning(f"Appears to have open pull request to update submodules! {pr.url}")
-            break
-
-    # XXX What else can we check? What about having access to Jenkins?
+            return pr
@@ -1,16 +1,29 @@
 import datetime
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import git
-from github import Github, GithubException
+from github import GithubException
 
-from .constants import GITHUB_ACCESS_TOKEN, KUMA_REPO_NAME
-from .exceptions import DirtyRepoError, MasterBranchError, SubmoduleFindingError
-from .utils import info, success, warning
+from . import resolver
+from .constants import KUMA_REPO_NAME
+from .exceptions import (
+    DirtyRepoError,
+    MasterBranchError,
+    SubmoduleFindingError,
+    SubmoduleUpdateError,
+)
+from .httpcache import get_github
+from .utils import clone_kwargs, error, info, success, warning
 
 
 def make_submodules_pr(
     repo_location, config, accept_dirty=False, branch_name=None, only_submodules=None
 ):
+    """Returns a dict with the "branch" name, the "updates" (submodule name ->
+    [short_sha, short_sha2]) and the "pr" number (None if no pull request
+    was created)."""
     repo = git.Repo(repo_location)
     # Check if it's dirty
     if repo.is_dirty() and not accept_dirty:
@@ -48,35 +61,47 @@ def make_submodules_pr(
         new_branch.checkout()
 
     # Check out all the latest and greatest submodules
-    actual_updates = {}
     upstream_name = config.get("submodules_upstream_name") or config["upstream_name"]
-    for submodule in repo.submodules:
-        if only_submodules and submodule.name not in only_submodules:
+    submodules = [
+        submodule
+        for submodule in repo.submodules
+        if not only_submodules or submodule.name in only_submodules
+    ]
+    # Each submodule is its own repo, so they can all be updated at the same
+    # time. Only initializing one writes to the superproject's config.
+    init_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=min(max(len(submodules), 1), 4)) as executor:
+        futures = [
+            executor.submit(
+                _update_submodule, submodule, config, upstream_name, init_lock
+            )
+            for submodule in submodules
+        ]
+    # Report in the order of the submodules regardless of which finished first.
+    actual_updates = {}
+    failures = []
+    for submodule, future in zip(submodules, futures):
+        try:
+            sha, sha2, short_sha, short_sha2 = future.result()
+        except Exception as exception:
+            error(f"Submodule {submodule.name!r} failed to update: {exception}")
+            failures.append(submodule.name)
             continue
-
-        sub_repo = submodule.module()
-        submodule.update(init=True)
-        sub_repo.git.checkout(config["master_branch"])
-        sha = sub_repo.head.object.hexsha
-        short_sha = sub_repo.git.rev_parse(sha, short=7)
-        for remote in sub_repo.remotes:
-            if remote.name == upstream_name:
-                break
-        else:
-            raise SubmoduleFindingError(f"Can't find origin {upstream_name!r}")
-        remote.pull(config["master_branch"])
-
-        sha2 = sub_repo.head.object.hexsha
-        short_sha2 = sub_repo.git.rev_parse(sha2, short=7)
-
         if sha != sha2:
             info(f"Submodule {submodule.name!r} from {short_sha} to {short_sha2}")
             actual_updates[submodule.name] = [short_sha, short_sha2]
         else:
             warning(f"Submodule {submodule.name!r} already latest and greatest.")
+    if failures:
+        raise SubmoduleUpdateError(
+            f"Couldn't update submodule{'s' if len(failures) > 1 else ''}: "
+            f"{', '.join(failures)}"
+        )
 
     # actual_updates = {"kumascript": ["b70bab1", "9c29f10"]}
 
+    pr_number = None
+
     if actual_updates:
         msg = f"Submodule{'s' if len(actual_updates) > 1 else ''}:"
         for name in sorted(actual_updates):
@@ -92,17 +117,17 @@ def make_submodules_pr(
         print("PUSHED:", repr(pushed))
 
         head_name = f"{config['your_remote_name']}:{branch_name}"
+        body = f"Updating the submodule{'s' if len(actual_updates) > 1 else ''}! 😊\n"
+        body += submodules_changelog(repo, actual_updates, upstream_name)
         try:
-            g = Github(GITHUB_ACCESS_TOKEN)
+            g = get_github()
             g_repo = g.get_repo(KUMA_REPO_NAME)
 
-            # Would be cool if this could list the difference!
-            body = (
-                f"Updating the submodule{'s' if len(actual_updates) > 1 else ''}! 😊\n"
+            created_pr = g_repo.create_pull(
+                title=msg, body=body, base="master", head=head_name
             )
-
-            created_pr = g_repo.create_pull(msg, body, "master", head_name)
             success(f"Now go and patiently wait for {created_pr.html_url} to go green.")
+            pr_number = created_pr.number
 
         except GithubException as exception:
             warning("GitHub integration failed:", exception)
@@ -113,6 +138,8 @@ def make_submodules_pr(
                 f"{config['your_remote_name']}:{branch_name}?expand=1"
             )
             success(f"\n\t{create_pr_url}\n")
+            info("With this description:\n")
+            info(body)
 
         # Back to master branch
         repo.heads[config["master_branch"]].checkout()
@@ -124,3 +151,97 @@ def make_submodules_pr(
         success(f"\n\tgit branch -d {branch_name}")
         info("\n\t# optional, if you didn't already delete the remote branch...")
         success(f"\n\tgit push {config['your_remote_name']} :{branch_name}\n")
+    else:
+        # Nothing to commit so no point staying on the new branch.
+        repo.heads[config["master_branch"]].checkout()
+
+    return {"branch": branch_name, "updates": actual_updates, "pr": pr_number}
+
+
+merge_pr_regex = re.compile(r"^Merge pull request #(\d+) from ")
+squash_pr_regex = re.compile(r"\(#(\d+)\)$")
+github_url_regex = re.compile(r"github\.com[:/]([^/]+/[^/]+?)(?:\.git)?/?$")
+
+
+def submodules_changelog(repo, actual_updates, upstream_name, max_commits=50):
+    """Return a Markdown list of what changed in each updated submodule.
+    It's all from the local repos (one `git log` per submodule) so there are
+    no extra network round trips or GitHub API calls."""
+    changelog = ""
+    for name in sorted(actual_updates):
+        short_sha, short_sha2 = actual_updates[name]
+        sub_repo = repo.submodules[name].module()
+        github_name = None
+        for remote in sub_repo.remotes:
+            if remote.name == upstream_name:
+                for url in remote.urls:
+                    match = github_url_regex.search(url)
+                    if match:
+                        github_name = match.group(1)
+        changelog += f"\n### {name} `{short_sha}...{short_sha2}`\n"
+        if github_name:
+            changelog += (
+                f"https://github.com/{github_name}/compare/{short_sha}...{short_sha2}\n"
+            )
+        changelog += "\n"
+
+        # The ASCII unit and record separators can't be in commit messages.
+        log = sub_repo.git.log(
+            "--first-parent",
+            "--format=%h%x1f%an%x1f%s%x1f%b%x1e",
+            f"{short_sha}..{short_sha2}",
+        )
+        commits = [x.strip("\n").split("\x1f") for x in log.split("\x1e") if x.strip()]
+        for short, author, subject, body in commits[:max_commits]:
+            pr_number = None
+            match = merge_pr_regex.match(subject)
+            if match:
+                pr_number = match.group(1)
+                # The title of the pull request is in the body of merge commits.
+                subject = body.strip().splitlines()[0] if body.strip() else subject
+            else:
+                match = squash_pr_regex.search(subject)
+                if match:
+                    pr_number = match.group(1)
+                    subject = subject[: match.start()].strip()
+            line = f"- {short} {subject} ({author})"
+            if pr_number and github_name:
+                # Without the repo name, GitHub would link it to a Kuma PR.
+                line += f" {github_name}#{pr_number}"
+            elif pr_number:
+                line += f" (PR {pr_number})"
+            changelog += line + "\n"
+        if len(commits) > max_commits:
+            changelog += f"- ...and {len(commits) - max_commits} more\n"
+    return changelog
+
+
+def _update_submodule(submodule, config, upstream_name, init_lock):
+    """Update the submodule to the latest upstream master and return the
+    full shas from before and after and their short shas (for display)."""
+    if submodule.module_exists():
+        submodule.update(init=True)
+    else:
+        with init_lock:
+            submodule.update(init=True, **clone_kwargs(config))
+    sub_repo = submodule.module()
+    sub_repo.git.checkout(config["master_branch"])
+    resolver.invalidate(sub_repo)
+    sha = resolver.resolve(sub_repo, "HEAD")
+    for remote in sub_repo.remotes:
+        if remote.name == upstream_name:
+            break
+    else:
+        raise SubmoduleFindingError(f"Can't find origin {upstream_name!r}")
+    remote.pull(config["master_branch"])
+    resolver.invalidate(sub_repo)
+    sha2 = resolver.resolve(sub_repo, "HEAD")
+
+    # Both abbreviated now, after the pull, so they're unambiguous among
+    # the objects it brought in.
+    return (
+        sha,
+        sha2,
+        resolver.short_sha(sub_repo, sha),
+        resolver.short_sha(sub_repo, sha2),
+    )
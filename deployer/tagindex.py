@@ -0,0 +1,117 @@
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import CACHE_DIR, DOCKER_HUB_API_URL
+from .httpcache import cached_get
+from .utils import write_json
+
+sha_tag_regex = re.compile(r"^[a-f0-9]{7,40}$")
+
+
+def _index_path(image_name):
+    return os.path.join(CACHE_DIR, "tags", image_name.replace("/", "-") + ".json")
+
+
+def load_index(image_name):
+    """Return the on-disk index of tags published for `image_name` (e.g.
+    'mdnwebdocs/kuma') as a dict of tag name -> {"digest", "last_updated"}."""
+    try:
+        with open(_index_path(image_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_index(image_name, index):
+    # Atomically, so an interrupted run can't leave a half-written index.
+    write_json(_index_path(image_name), index, indent=1, sort_keys=True)
+
+
+def sync_index(image_name, page_size=100):
+    """Bring the on-disk index up to date and return it.
+
+    Docker Hub lists tags newest-first so we page through until we hit a
+    tag we already have (with the same 'last_updated', because tags like
+    'latest' are overwritten). On a warm index that's a single request.
+    The index is only saved once the sync has completed, so it never has
+    a gap of unseen tags in it.
+    """
+    index = load_index(image_name)
+    new_tags = {}
+    url = f"{DOCKER_HUB_API_URL}/{image_name}/tags/"
+    # Newest first.
+    params = {"page_size": page_size, "ordering": "last_updated"}
+    while url:
+        response = cached_get(url, params=params)
+        response.raise_for_status()
+        data = response.json()
+        for result in data["results"]:
+            known = index.get(result["name"])
+            if known and known["last_updated"] == result["last_updated"]:
+                url = None
+                break
+            new_tags[result["name"]] = {
+                "digest": get_digest(result),
+                "last_updated": result["last_updated"],
+            }
+        else:
+            url = data.get("next")
+            # The 'next' URL already contains all the query string.
+            params = None
+
+    if new_tags:
+        index.update(new_tags)
+        save_index(image_name, index)
+    return index
+
+
+def sync_indexes(image_names):
+    """Sync all the indexes at the same time and return them in the same
+    order."""
+    with ThreadPoolExecutor(max_workers=max(len(image_names), 1)) as executor:
+        futures = [
+            executor.submit(sync_index, image_name) for image_name in image_names
+        ]
+        return [future.result() for future in futures]
+
+
+def get_digest(result):
+    if result.get("digest"):
+        return result["digest"]
+    # Older tags only have the digest on the individual (per arch) images.
+    for image in result.get("images") or []:
+        if image.get("digest"):
+            return image["digest"]
+    return None
+
+
+def published_commits(index, repo, rev="HEAD", max_count=10):
+    """Return a list of (commit, tag name or None) for the last `max_count`
+    commits reachable (first parent) from `rev`."""
+    # Bucket the sha-like tags by their first 7 characters so each commit
+    # is a dict lookup rather than a scan through all tags.
+    by_prefix = {}
+    for name in index:
+        if sha_tag_regex.match(name):
+            by_prefix.setdefault(name[:7], []).append(name)
+    commits = []
+    for commit in repo.iter_commits(rev, max_count=max_count, first_parent=True):
+        for name in by_prefix.get(commit.hexsha[:7], []):
+            if commit.hexsha.startswith(name):
+                commits.append((commit, name))
+                break
+        else:
+            commits.append((commit, None))
+    return commits
+
+
+def newest_published_ancestor(index, repo, rev="HEAD", max_count=500):
+    """Return (commit, tag name, distance) for the newest commit reachable
+    (first parent) from `rev` that has a published image, or None."""
+    commits = published_commits(index, repo, rev=rev, max_count=max_count)
+    for distance, (commit, name) in enumerate(commits):
+        if name:
+            return commit, name, distance
+    return None
@@ -1,8 +1,23 @@
+import collections
+import hashlib
+import json
+import os
+import selectors
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
 import click
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+from . import profiler
+from .constants import CACHE_DIR
+from .exceptions import CommandError
+
 
 def error(*msg):
     msg = " ".join([str(x) for x in msg])
@@ -25,7 +40,11 @@ def success(*msg):
 
 
 def requests_retry_session(
-    retries=4, backoff_factor=0.4, status_forcelist=(500, 502, 504), session=None
+    retries=4,
+    backoff_factor=0.4,
+    status_forcelist=(500, 502, 504),
+    session=None,
+    pool_maxsize=10,
 ):
     """Opinionated wrapper that creates a requests session with a
     HTTPAdapter that sets up a Retry policy that includes connection
@@ -54,12 +73,51 @@ def requests_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
 
+def checkout_cache_path(kind, repo_location):
+    """Return the path of the JSON file, in the `kind` directory of the
+    cache, that belongs to this checkout of a repo."""
+    key = hashlib.md5(os.path.abspath(repo_location).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, kind, f"{key}.json")
+
+
+def write_json(path, data, **kwargs):
+    """Write `data` as JSON to `path`, atomically. It's written to a new
+    temporary file next to it that then replaces it, so nothing (not even a
+    concurrent writer) can ever see or leave behind a half-written file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def clone_kwargs(config):
+    """Return the extra keyword arguments for a submodule's `update()`. With
+    --fetch-depth a submodule that isn't cloned yet is cloned shallow, with
+    only that many commits of history.
+
+    An existing clone is never made shallow. Pulling into it, shallow or
+    not, brings in every new commit so the log of what changed is
+    complete."""
+    kwargs = {}
+    if config.get("fetch_depth"):
+        kwargs["clone_multi_options"] = [f"--depth={config['fetch_depth']}"]
+    return kwargs
+
+
 def _humanize_time(amount, units):
     """Chopped and changed from http://stackoverflow.com/a/6574789/205832"""
     intervals = (1, 60, 60 * 60, 60 * 60 * 24, 604800, 2419200, 29030400)
@@ -87,3 +145,107 @@ def _humanize_time(amount, units):
 
 def humanize_seconds(seconds):
     return "{} {}".format(*_humanize_time(seconds, "seconds")[0])
+
+
+def fmt_seconds(delta):
+    seconds = int(delta)
+    if seconds > 60:
+        minutes = seconds // 60
+        seconds = seconds % 60
+        return (
+            f"{minutes} minute{'s' if minutes > 1 else ''} "
+            f"{seconds} second{'s' if seconds > 1 else ''} "
+        )
+    return f"{seconds} second{'s' if seconds > 1 else ''} "
+
+
+def run_command(command, cwd=None, log_filename=None, phases=(), tail_size=100):
+    """Run the command, echoing its stdout and stderr as it comes, and
+    return a dict with the "seconds" it took, the "tail" (the last
+    `tail_size` lines) and the "phases", a list of (name, seconds).
+
+    Both streams are read without blocking, with a selector, so neither can
+    fill up its pipe and stall the process. If `log_filename` is set,
+    everything is written there too, buffered. `phases` is a sequence of
+    (name, regex) and a line that matches a phase's regex starts that phase.
+
+    Raises CommandError, with the tail in the message, if the command
+    fails."""
+    if isinstance(command, str):
+        command = shlex.split(command)
+    with profiler.span("subprocess", command[0], command=" ".join(command)):
+        return _run_command(command, cwd, log_filename, phases, tail_size)
+
+
+def _run_command(command, cwd, log_filename, phases, tail_size):
+    t0 = time.time()
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd
+    )
+    tail = collections.deque(maxlen=tail_size)
+    timed_phases = []
+    current_phase = None
+    log = open(log_filename, "wb", buffering=1024 * 1024) if log_filename else None
+
+    selector = selectors.DefaultSelector()
+    outputs = {
+        process.stdout.fileno(): sys.stdout.buffer,
+        process.stderr.fileno(): sys.stderr.buffer,
+    }
+    partial = {}
+    for fd in outputs:
+        os.set_blocking(fd, False)
+        selector.register(fd, selectors.EVENT_READ)
+        partial[fd] = b""
+
+    def handle_line(line):
+        nonlocal current_phase
+        text = line.decode("utf-8", "replace").rstrip()
+        tail.append(text)
+        for name, regex in phases:
+            if name != current_phase and regex.search(text):
+                now = time.time()
+                if timed_phases:
+                    timed_phases[-1][1] = now - timed_phases[-1][1]
+                timed_phases.append([name, now])
+                current_phase = name
+                break
+
+    try:
+        while selector.get_map():
+            for key, __ in selector.select():
+                fd = key.fd
+                chunk = os.read(fd, 64 * 1024)
+                if not chunk:
+                    selector.unregister(fd)
+                    if partial[fd]:
+                        handle_line(partial[fd])
+                    continue
+                outputs[fd].write(chunk)
+                outputs[fd].flush()
+                if log:
+                    log.write(chunk)
+                *lines, partial[fd] = (partial[fd] + chunk).split(b"\n")
+                for line in lines:
+                    handle_line(line)
+        returncode = process.wait()
+    finally:
+        selector.close()
+        process.stdout.close()
+        process.stderr.close()
+        if log:
+            log.close()
+
+    t1 = time.time()
+    if timed_phases:
+        timed_phases[-1][1] = t1 - timed_phases[-1][1]
+    if returncode:
+        raise CommandError(
+            f"{' '.join(command)!r} exited with {returncode}. The last lines were:\n"
+            + "\n".join(tail)
+        )
+    return {
+        "seconds": t1 - t0,
+        "tail": list(tail),
+        "phases": [tuple(x) for x in timed_phases],
+    }
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import CACHE_DIR
+from .exceptions import NoWatchURLsError, WaitTimeoutError
+from .httpcache import cached_get
+from .utils import fmt_seconds, info, success, write_json
+
+# How many past runs to remember (per URL) for learning how long it takes.
+HISTORY_SIZE = 10
+
+
+def _history_path():
+    return os.path.join(CACHE_DIR, "watch-history.json")
+
+
+def load_history():
+    """Return a dict of URL -> list of how many seconds it took (most
+    recent last) for the previous deploys to show up."""
+    try:
+        with open(_history_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def record_history(url, seconds):
+    history = load_history()
+    history[url] = (history.get(url, []) + [round(seconds, 1)])[-HISTORY_SIZE:]
+    write_json(_history_path(), history, indent=1, sort_keys=True)
+
+
+def expected_seconds(url):
+    """Return the median of how long it took the last times or None if
+    there's no history for this URL."""
+    seconds = load_history().get(url)
+    if seconds:
+        return statistics.median(seconds)
+    return None
+
+
+def next_interval(elapsed, interval, expected, min_interval, max_interval):
+    """Return how many seconds to wait till the next check.
+
+    Right after a push it checks often, then the interval widens. But if we
+    know (from past runs) roughly when it usually finishes, it tightens again
+    around that time.
+    """
+    if expected and expected * 0.75 <= elapsed + interval <= expected * 1.5:
+        return min_interval
+    return min(max_interval, interval * 1.5)
+
+
+def conditional_get(url, previous=None):
+    """Return (changed, response) where changed is whether the content is
+    different from the `previous` response. The request is revalidated
+    against the HTTP cache so an unchanged answer is a body-less 304."""
+    response = cached_get(url)
+    response.raise_for_status()
+    changed = previous is None or response.text != previous.text
+    return changed, response
+
+
+def watch_endpoints(urls, sleep_seconds=5, max_sleep_seconds=60, timeout=30 * 60):
+    """Watch all the `urls` at the same time until every one of them has
+    changed. Reports when each one switched and then a summary of how long
+    the whole thing took to propagate. Returns a dict of URL -> seconds.
+    Raises WaitTimeoutError if any of them hasn't changed after `timeout`
+    seconds."""
+    if not urls:
+        raise NoWatchURLsError(
+            "No URLs to watch. Pass some or set DEPLOYER_STAGE_WATCH_URLS "
+            "and DEPLOYER_PROD_WATCH_URLS."
+        )
+    return asyncio.run(
+        _watch_endpoints(urls, sleep_seconds, max_sleep_seconds, timeout)
+    )
+
+
+async def _watch_endpoints(urls, sleep_seconds, max_sleep_seconds, timeout):
+    loop = asyncio.get_running_loop()
+    # The HTTP requests are done in threads (over the shared session) but all
+    # the waiting is done in the event loop.
+    executor = ThreadPoolExecutor(max_workers=min(len(urls), 32))
+
+    def get(url, previous=None):
+        return loop.run_in_executor(executor, conditional_get, url, previous)
+
+    t0 = time.time()
+    deadline = t0 + timeout
+    first_responses = [
+        response for __, response in await asyncio.gather(*(get(url) for url in urls))
+    ]
+    info(f"Watching for changes to output from {len(urls)} endpoints")
+    for url in urls:
+        expected = expected_seconds(url)
+        if expected:
+            print(f"\t{url} (usually takes about {fmt_seconds(expected).strip()})")
+        else:
+            print(f"\t{url}")
+    print(f"(checking every {sleep_seconds} to {max_sleep_seconds} seconds)")
+
+    async def watch(url, first_response):
+        expected = expected_seconds(url)
+        response = first_response
+        interval = sleep_seconds
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise WaitTimeoutError(
+                    f"Gave up waiting for {url} to change after "
+                    f"{fmt_seconds(timeout).strip()}"
+                )
+            # Never sleep past the deadline, so there's always one last check.
+            await asyncio.sleep(min(interval, remaining))
+            changed, response = await get(url, response)
+            elapsed = time.time() - t0
+            if changed:
+                success(f"{url} has changed after {fmt_seconds(elapsed).strip()}")
+                info(f"\tfrom {first_response.text!r} to {response.text!r}")
+                record_history(url, elapsed)
+                return elapsed
+            interval = next_interval(
+                elapsed, interval, expected, sleep_seconds, max_sleep_seconds
+            )
+
+    async def progress():
+        while True:
+            await asyncio.sleep(max_sleep_seconds)
+            print(f"Been checking for {fmt_seconds(time.time() - t0)}")
+
+    reporter = asyncio.ensure_future(progress())
+    try:
+        switched = await asyncio.gather(
+            *(watch(url, response) for url, response in zip(urls, first_responses))
+        )
+    finally:
+        reporter.cancel()
+        executor.shutdown(wait=False)
+
+    print("")  # whitespace
+    info("Propagation summary:")
+    for url, seconds in sorted(zip(urls, switched), key=lambda x: x[1]):
+        info(f"\t{fmt_seconds(seconds):<24} {url}")
+    first_seen, last_seen = min(switched), max(switched)
+    success(
+        f"First seen after {fmt_seconds(first_seen).strip()}, "
+        f"last seen after {fmt_seconds(last_seen).strip()} "
+        f"(spread {fmt_seconds(last_seen - first_seen).strip()})."
+    )
+    info("Stopping the watcher. Bye!")
+    return dict(zip(urls, switched))